@@ -684,7 +684,7 @@ def get_pareto(nclicks, clickdata, total_max_walking_time, crawl_date, start_tim
             start_coord = None
         solutions = crawl_model(min_review_ct, min_review, crawl_date, budget_range, start_time, end_time, num_stops,
                                 total_max_walking_time, single_walking_time, max_waiting_time,
-                                'data/processed_data.csv', 'data/distances.csv', start_coord, unsupervised)
+                                'data/processed_data.csv', 'data/distances.npy', start_coord, unsupervised)
 
         with open('data/solutions.pkl', 'wb') as handle:
             pickle.dump(solutions, handle, protocol=pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,167 @@
+from datetime import datetime
+import json
+import os
+from models.models import get_candidates, get_pareto_routes
+from models.gurobi_route import get_optimal_route
+from preprocessing.business_processing import BAR_RULES_FILE, BarRules, clean_dtypes, generate_business_df, read_json
+import time
+
+
+def compare_formulations(df, dima, closest_bar_id, start_time, end_time, bar_num, total_max_walking_time,
+                         max_walking_each, max_total_wait, configs):
+    """
+    Solves the same route problem with each formulation and prints the root gap and the solve time
+    :param configs: list of dicts of keyword arguments for get_optimal_route (e.g. {'formulation': 'flow'})
+    :return: list of dicts, one per config
+    """
+    results = []
+    for config in configs:
+        start = time.time()
+        model, y, z = get_optimal_route(df, start_time, end_time, bar_num, total_max_walking_time, max_walking_each,
+                                        max_total_wait, dima, closest_bar_id, **config)
+        total = time.time() - start
+
+        # Root gap: LP relaxation bound against the best route found
+        relaxed = model.relax()
+        relaxed.setParam('OutputFlag', 0)
+        relaxed.optimize()
+        result = {'config': config, 'variables': model.NumVars, 'constraints': model.NumConstrs,
+                  'status': model.status, 'solve_time': model.Runtime, 'total_time': total,
+                  'objective': None, 'root_bound': None, 'root_gap': None}
+        if model.SolCount > 0:
+            result['objective'] = model.objVal
+            if relaxed.status == 2:
+                result['root_bound'] = relaxed.objVal
+                result['root_gap'] = (relaxed.objVal - model.objVal) / abs(model.objVal)
+        results.append(result)
+
+    for result in results:
+        print("--- {}".format(result['config']))
+        print("    {} variables, {} constraints, status {}".format(result['variables'], result['constraints'],
+                                                                 result['status']))
+        print("    objective {}, root bound {}, root gap {}".format(result['objective'], result['root_bound'],
+                                                                  result['root_gap']))
+        print("    solve time {:.2f}s, build + solve {:.2f}s".format(result['solve_time'], result['total_time']))
+    return results
+
+
+def compare_solvers(df, dima, closest_bar_id, start_time, end_time, bar_num, total_max_walking_time,
+                    max_walking_each, max_total_wait, solvers, reference='gurobi'):
+    """
+    Runs the Pareto sweep with each solver, cold so that no solver starts from the routes of another, and compares the
+    average rating of every walking budget with the reference solver's
+    :param solvers: list of get_pareto_routes solver names
+    :return: dict of solver name -> (sweep time, list of Solutions)
+    """
+    results = {}
+    for solver in solvers:
+        start = time.time()
+        solutions = get_pareto_routes(df, start_time, end_time, bar_num, total_max_walking_time, max_walking_each,
+                                      max_total_wait, dima, closest_bar_id, solver=solver, warm_starts=None)
+        results[solver] = (time.time() - start, solutions)
+
+    reference_ratings = {s.max_walking_time: s.avg_rating for s in results[reference][1]}
+    for solver in solvers:
+        sweep_time, solutions = results[solver]
+        ratings = {s.max_walking_time: s.avg_rating for s in solutions}
+        gaps = [(reference_ratings[budget] - ratings.get(budget, 0)) / reference_ratings[budget]
+                for budget in reference_ratings]
+        print("--- {}: {:.3f}s, {} routes".format(solver, sweep_time, len(solutions)))
+        if gaps:
+            print("    rating gap to {}: mean {:.2%}, max {:.2%}, optimal on {}/{} budgets".format(
+                reference, sum(gaps) / len(gaps), max(gaps), sum(gap <= 1e-9 for gap in gaps), len(gaps)))
+    return results
+
+
+def compare_adaptive(df, dima, closest_bar_id, start_time, end_time, bar_num, total_max_walking_time,
+                     max_walking_each, max_total_wait, solver='gurobi'):
+    """
+    Runs the Pareto sweep with and without the adaptive budget sweep, which has to find the same rating at every
+    walking budget
+    :return: list of the budgets where the ratings differ
+    """
+    results = {}
+    for adaptive in [True, False]:
+        start = time.time()
+        solutions = get_pareto_routes(df, start_time, end_time, bar_num, total_max_walking_time, max_walking_each,
+                                      max_total_wait, dima, closest_bar_id, solver=solver, adaptive=adaptive,
+                                      warm_starts=None)
+        results[adaptive] = (time.time() - start, {s.max_walking_time: s.avg_rating for s in solutions})
+
+    budgets = sorted(set(results[True][1]) | set(results[False][1]))
+    different = [budget for budget in budgets
+                 if abs(results[True][1].get(budget, 0) - results[False][1].get(budget, 0)) > 1e-9]
+    print("--- {}: adaptive {:.3f}s, every budget {:.3f}s, same ratings on {}/{} budgets".format(
+        solver, results[True][0], results[False][0], len(budgets) - len(different), len(budgets)))
+    if different:
+        print("    ratings differ for max walking times {}".format(different))
+    return different
+
+
+def compare_bar_filters(business_json_file, city, rules_file=BAR_RULES_FILE):
+    """
+    Times the bar filter of one_time_filter on a business.json dump: the compiled rule table against a str.contains
+    scan per rule, and the whole streaming ingestion
+    :return: dict of timings in seconds
+    """
+    start = time.time()
+    df = clean_dtypes(read_json(business_json_file))
+    load_time = time.time() - start
+
+    start = time.time()
+    compiled = BarRules.from_file(rules_file).mask(df)
+    compiled_time = time.time() - start
+
+    with open(rules_file) as handle:
+        rules = json.load(handle)
+    start = time.time()
+    scanned = df['categories'].str.contains('|'.join(rules['category_include']))
+    for term in rules['category_exclude']:
+        scanned &= ~df['categories'].str.contains(term, regex=False)
+    for term in rules['name_exclude']:
+        scanned &= ~df['name'].fillna('').str.contains(term, regex=False)
+    scan_time = time.time() - start
+
+    start = time.time()
+    bars = generate_business_df(business_json_file, city, rules_file=rules_file)
+    ingestion_time = time.time() - start
+
+    print("--- {} businesses, loaded in {:.2f}s".format(len(df), load_time))
+    print("    compiled rules {:.2f}s, one scan per rule {:.2f}s, same rows: {}".format(
+        compiled_time, scan_time, bool((compiled == scanned).all())))
+    print("    streaming ingestion of the {} bars of {}: {:.2f}s".format(len(bars), city, ingestion_time))
+    return {'load': load_time, 'compiled': compiled_time, 'scan': scan_time, 'ingestion': ingestion_time}
+
+
+if __name__ == "__main__":
+    min_review_ct = 20
+    min_rating = 3.7
+    date = datetime(2019, 8, 9)
+    budget_range = [1, 2, 3, 4]
+    start_time = 17
+    end_time = 22
+    bar_num = 6
+    total_max_walking_time = 1
+    max_walking_each = 0.35
+    max_total_wait = 1.0
+    csv = "data/processed_data.csv"
+    distance_csv = "data/distances.npy"
+    start_coord = (43.6426, -79.3871)
+
+    df, dima, closest_bar_id = get_candidates(min_review_ct, min_rating, date, budget_range, total_max_walking_time,
+                                              csv, distance_csv, start_coord, True)
+
+    compare_formulations(df, dima, closest_bar_id, start_time, end_time, bar_num, total_max_walking_time,
+                         max_walking_each, max_total_wait,
+                         [{'formulation': 'bigm'}, {'formulation': 'flow'},
+                          {'formulation': 'bigm', 'sparse': True}, {'formulation': 'flow', 'sparse': True},
+                          {'formulation': 'bigm', 'lazy': True}, {'formulation': 'bigm', 'sparse': True, 'lazy': True}])
+
+    compare_solvers(df, dima, closest_bar_id, start_time, end_time, bar_num, total_max_walking_time, max_walking_each,
+                    max_total_wait, ['gurobi', 'pulp', 'heuristic', 'dp'])
+
+    compare_adaptive(df, dima, closest_bar_id, start_time, end_time, bar_num, total_max_walking_time,
+                     max_walking_each, max_total_wait)
+
+    if os.path.exists('data/business.json'):
+        compare_bar_filters('data/business.json', 'Toronto')
@@ -0,0 +1,556 @@
+# Route solver backends behind one interface, so the Pareto sweep does not depend on a specific solver
+import inspect
+import time
+import numpy as np
+from models.problem import get_arcs
+from models.heuristic import heuristic_route, improve_route
+from models.dp import dp_pareto_routes
+
+try:
+    from gurobipy import Env, GRB, GurobiError
+    from models.gurobi_route import RouteModel
+except ImportError:  # Gurobi is optional
+    RouteModel = None
+
+try:
+    import pulp
+except ImportError:  # PuLP is optional
+    pulp = None
+
+# Backend statuses
+OPTIMAL = 'optimal'
+FEASIBLE = 'feasible'  # a route was found, but not proven optimal
+INFEASIBLE = 'infeasible'
+NO_SOLUTION = 'no_solution'  # no route found, infeasibility not proven
+
+
+class RouteBackend:
+    """
+    A route solver, built once for the largest walking time budget and then solved for any smaller budget
+    """
+    # whether exclude_bars is implemented, which solve_alternatives needs
+    supports_exclusions = False
+
+    def __init__(self, problem, total_max_walking_time, threads=None):
+        """
+        :param problem: CrawlProblem
+        :param total_max_walking_time: largest walking time budget, in hours
+        :param threads: cap on the threads the backend may use (None for the solver default)
+        """
+        self.problem = problem
+        self.total_max_walking_time = total_max_walking_time
+        self.threads = threads
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def set_max_walking_time(self, total_max_walking_time):
+        self.total_max_walking_time = total_max_walking_time
+
+    def set_start(self, route):
+        """
+        Warm start for the next solves
+        :param route: bar index at each stop, None for the bars that are not candidates any more
+        """
+        pass
+
+    def set_time_limit(self, seconds):
+        """
+        Caps the time of the next solves (backends without a time limit ignore it)
+        """
+        pass
+
+    def set_incumbent_callback(self, callback):
+        """
+        :param callback: called with each improving route found during the next solves, by the backends that report
+        them, or None
+        """
+        pass
+
+    def exclude_bars(self, bars, max_shared):
+        """
+        No-good cut for the next solves: only routes sharing at most max_shared of these bars are accepted
+        :param bars: list of bar indices
+        """
+        raise NotImplementedError
+
+    def clear_exclusions(self):
+        """
+        Removes the cuts of exclude_bars
+        """
+        raise NotImplementedError
+
+    def solve(self):
+        raise NotImplementedError
+
+    def status(self):
+        """
+        :return: Status of the last solve (OPTIMAL, FEASIBLE, INFEASIBLE or NO_SOLUTION)
+        """
+        raise NotImplementedError
+
+    def route(self):
+        """
+        :return: The bars of the selected arcs in visiting order (list of indices), or None
+        """
+        raise NotImplementedError
+
+    def solve_budgets(self, budgets, adaptive=True, starts=None, on_route=None, deadline=None):
+        """
+        :param budgets: walking time budgets in minutes, each at most the budget the backend was built for
+        :param adaptive: sweep from the smallest budget up, each budget starting from the route of the previous one
+        when it is feasible there. When the feasible routes of each budget are a subset of those of the larger ones
+        (the later arrivals of a smaller budget cannot open a bar, see CrawlProblem.budgets_nested), the largest budget
+        is solved right after the smallest: its optimal rating becomes the rating bound of the others, so its route is
+        also optimal at every budget it is feasible at, and if it is proven infeasible, so are all the others. If False,
+        every budget is solved in the given order.
+        In both cases, a route reaching the rating upper bound (see CrawlProblem.rating_bound) is optimal at every
+        remaining budget it is feasible at, whatever the backend, so none of those is solved.
+        :param starts: optional {budget: route} warm starts (see set_start), e.g. from models.warm_start
+        :param on_route: optional, called as on_route(budget, route, final) with the incumbents of the budget being
+        solved (final False, see set_incumbent_callback) and with the route each budget ends up with (final True)
+        :param deadline: time.time() after which no budget is started, the solve running then is cut at it
+        :return: {budget: route} for the budgets where a route was found
+        """
+        routes = {}
+
+        def found(budget, route):
+            routes[budget] = route
+            if on_route is not None:
+                on_route(budget, route, True)
+
+        rating_bound = self.problem.rating_bound()
+        largest = max(budgets, default=None)
+        nested = adaptive and largest is not None and self.problem.budgets_nested(largest / 60, min(budgets) / 60)
+        remaining = sorted(budgets) if adaptive else list(budgets)
+        if nested:
+            # the best rating of the largest budget bounds the ratings of all the others. The smallest one goes first
+            # still: a route reaching the rating bound there is feasible, so optimal, at all the budgets.
+            remaining.insert(1, remaining.pop())
+        while remaining:
+            if deadline is not None:
+                if time.time() >= deadline:
+                    print("Deadline reached, {} budgets not solved".format(len(remaining)))
+                    break
+                self.set_time_limit(deadline - time.time())
+            budget = remaining.pop(0)
+            print("Running Pareto for max walking time {}".format(budget))
+            self.set_max_walking_time(budget / 60)
+            if starts and budget in starts:
+                self.set_start(starts[budget])
+            if on_route is not None:
+                self.set_incumbent_callback(lambda route, budget=budget: on_route(budget, route, False))
+            self.solve()
+            status = self.status()
+            if status not in (OPTIMAL, FEASIBLE):
+                if nested and status == INFEASIBLE and budget == largest:
+                    # so is every smaller budget
+                    break
+                continue
+
+            route = self.route()
+            found(budget, route)
+            if nested and status == OPTIMAL and budget == largest:
+                rating_bound = min(rating_bound, self.problem.rating(route))
+            if self.problem.rating(route) >= rating_bound - 1e-9:
+                covered = [other for other in remaining if self.problem.is_feasible(route, other / 60)]
+                if covered:
+                    print("Route for max walking time {} reaches the rating bound, also optimal for {}".format(
+                        budget, covered))
+                for other in covered:
+                    found(other, route)
+                    remaining.remove(other)
+            if adaptive and remaining and self.problem.is_feasible(route, remaining[0] / 60):
+                self.set_start(route)
+        return routes
+
+    def solve_alternatives(self, routes, count, min_different_bars=1, deadline=None):
+        """
+        Next best routes of each budget, in the same model: each one differs from the route of the budget and from
+        every earlier alternative by at least min_different_bars bars, through a no-good cut per route found (see
+        exclude_bars) that is removed once the budget is done.
+        A budget whose route is the same as the one of the budget above it takes the alternatives of that budget when
+        they are all still feasible, without a solve, if its feasible routes are a subset of those of the budget above
+        (see CrawlProblem.budgets_nested).
+        :param routes: {budget: route} as returned by solve_budgets
+        :param count: number of alternatives wanted per budget
+        :param min_different_bars: between 1 and bar_num
+        :param deadline: see solve_budgets
+        :return: {budget: list of up to count routes, best first}
+        """
+        max_shared = self.problem.bar_num - min_different_bars
+        alternatives = {}
+        previous_budget, previous_route, previous_alternatives = None, None, None
+        for budget in sorted(routes, reverse=True):
+            route = routes[budget]
+            if route == previous_route and self.problem.budgets_nested(previous_budget / 60, budget / 60) \
+                    and all(self.problem.is_feasible(alternative, budget / 60) for alternative in previous_alternatives):
+                alternatives[budget] = previous_alternatives
+                continue
+            if deadline is not None:
+                if time.time() >= deadline:
+                    print("Deadline reached, no alternative routes for {} budgets".format(
+                        len(routes) - len(alternatives)))
+                    break
+                self.set_time_limit(deadline - time.time())
+
+            print("Looking for {} alternative routes for max walking time {}".format(count, budget))
+            self.set_max_walking_time(budget / 60)
+            self.set_incumbent_callback(None)
+            found = []
+            self.exclude_bars(route, max_shared)
+            try:
+                while len(found) < count:
+                    self.solve()
+                    if self.status() not in (OPTIMAL, FEASIBLE):
+                        break
+                    found.append(self.route())
+                    self.exclude_bars(found[-1], max_shared)
+            finally:
+                self.clear_exclusions()
+            alternatives[budget] = found
+            previous_budget, previous_route, previous_alternatives = budget, route, found
+        return alternatives
+
+    def close(self):
+        pass
+
+
+class GurobiBackend(RouteBackend):
+    """
+    RouteModel, re-solved from the previous incumbent at each budget
+    """
+    _available = None
+    supports_exclusions = True
+
+    def __init__(self, problem, total_max_walking_time, threads=None, sparse=False, formulation='bigm',
+                 timing=False, lazy=False):
+        """
+        :param threads: when set, the model also gets its own Gurobi environment (for process pool workers)
+        :param sparse: see RouteModel
+        :param formulation: see RouteModel
+        :param timing: see RouteModel
+        :param lazy: see RouteModel
+        """
+        if not self.available():
+            raise RuntimeError("The gurobi backend needs gurobipy and a Gurobi license, use solver='auto' to pick an "
+                               "available backend")
+        super().__init__(problem, total_max_walking_time, threads)
+        self.env = Env() if threads is not None else None
+        self.route_model = RouteModel(problem, total_max_walking_time, sparse, formulation, timing, self.env,
+                                      lazy)
+        if threads is not None:
+            self.route_model.model.setParam('Threads', threads)
+        # no need to close the gap of the LP bound once the best rated bars are all in the route
+        self.route_model.model.setParam('BestObjStop', problem.rating_bound() - 1e-6)
+        self.max_time_limit = self.route_model.model.Params.TimeLimit
+
+    @classmethod
+    def available(cls):
+        # gurobipy installed and a license to run it
+        if cls._available is None:
+            cls._available = False
+            if RouteModel is not None:
+                try:
+                    Env().dispose()
+                    cls._available = True
+                except GurobiError:
+                    pass
+        return cls._available
+
+    def set_max_walking_time(self, total_max_walking_time):
+        super().set_max_walking_time(total_max_walking_time)
+        self.route_model.set_max_walking_time(total_max_walking_time)
+
+    def set_start(self, route):
+        self.route_model.set_start(route)
+
+    def set_time_limit(self, seconds):
+        self.route_model.model.setParam('TimeLimit', min(self.max_time_limit, seconds))
+
+    def set_incumbent_callback(self, callback):
+        self.route_model.on_incumbent = callback
+
+    def exclude_bars(self, bars, max_shared):
+        self.route_model.exclude_bars(bars, max_shared)
+
+    def clear_exclusions(self):
+        self.route_model.clear_exclusions()
+
+    def solve(self):
+        self.route_model.optimize()
+
+    def status(self):
+        model = self.route_model.model
+        if model.status == GRB.OPTIMAL:
+            return OPTIMAL
+        if model.SolCount > 0:
+            return FEASIBLE
+        if model.status in [GRB.INFEASIBLE, GRB.INF_OR_UNBD, GRB.UNBOUNDED]:
+            return INFEASIBLE
+        return NO_SOLUTION
+
+    def route(self):
+        if self.route_model.model.SolCount == 0:
+            return None
+        return self.route_model.route(self.route_model.z.X)
+
+    def close(self):
+        self.route_model.model.dispose()
+        if self.env is not None:
+            self.env.dispose()
+
+
+class PulpBackend(RouteBackend):
+    """
+    Open-source MIP backend: the 'flow' formulation of RouteModel over the pruned arcs, solved with CBC through PuLP
+    """
+    supports_exclusions = True
+
+    def __init__(self, problem, total_max_walking_time, threads=None, sparse=True, time_limit=30):
+        """
+        :param sparse: only create the movement variables that can be part of a feasible route (see get_arcs)
+        :param time_limit: CBC time limit per solve, in seconds
+        """
+        super().__init__(problem, total_max_walking_time, threads)
+        self.max_time_limit = time_limit
+        self.time_limit = time_limit
+        n = len(problem.ratings)
+        stops = problem.bar_num - 1
+        arc_k, arc_i, arc_j = get_arcs(problem.dima, problem.open_times, problem.close_times, problem.wait_times,
+                                       problem.start_time, problem.end_time, problem.bar_num,
+                                       problem.max_walking_each, problem.max_total_wait,
+                                       problem.time_spent_each_bar(total_max_walking_time), sparse)
+        moves = arc_i != arc_j
+        self.arc_i = arc_i[moves]
+        self.arc_j = arc_j[moves]
+        self.arcs = list(zip(arc_k[moves].tolist(), self.arc_i.tolist(), self.arc_j.tolist()))
+        print("{} movement variables".format(len(self.arcs)))
+
+        m = pulp.LpProblem("opt_route", pulp.LpMaximize)
+        y = [pulp.LpVariable("y_{}".format(i), cat='Binary') for i in range(n)]
+        z = [pulp.LpVariable("z_{}_{}_{}".format(k, i, j), cat='Binary') for (k, i, j) in self.arcs]
+        t = [pulp.LpVariable("t_{}".format(k), problem.start_time, problem.end_time) for k in range(problem.bar_num)]
+
+        stop_arcs = [[] for k in range(stops)]
+        # position[k][i]: moves placing bar i at position k (origin of move k, or destination of the last move)
+        position = [[[] for i in range(n)] for k in range(problem.bar_num)]
+        out_arcs = [[[] for i in range(n)] for k in range(stops)]
+        in_arcs = [[[] for i in range(n)] for k in range(stops)]
+        for a, (k, i, j) in enumerate(self.arcs):
+            stop_arcs[k].append(a)
+            out_arcs[k][i].append(a)
+            in_arcs[k][j].append(a)
+            position[k][i].append(a)
+            if k == stops - 1:
+                position[stops][j].append(a)
+
+        m += pulp.lpSum(problem.ratings[i] * y[i] for i in range(n))
+        m += pulp.lpSum(y) == problem.bar_num
+        m += (pulp.lpSum(problem.dima[i, j] * z[a] for a, (k, i, j) in enumerate(self.arcs))
+              <= total_max_walking_time, "walk")
+        for k in range(stops):
+            m += pulp.lpSum(problem.dima[self.arcs[a][1], self.arcs[a][2]] * z[a] for a in stop_arcs[k]) \
+                <= problem.max_walking_each
+            m += pulp.lpSum(z[a] for a in stop_arcs[k]) == 1
+        if problem.start is not None:
+            m += y[problem.start] == 1
+            m += pulp.lpSum(z[a] for a in out_arcs[0][problem.start]) == 1
+        for k in range(1, stops):
+            for i in range(n):
+                if in_arcs[k - 1][i] or out_arcs[k][i]:
+                    m += pulp.lpSum(z[a] for a in in_arcs[k - 1][i]) == pulp.lpSum(z[a] for a in out_arcs[k][i])
+        for i in range(n):
+            m += y[i] == pulp.lpSum(z[a] for k in range(problem.bar_num) for a in position[k][i])
+
+        m += t[0] == problem.start_time
+        self.time_constrs = []
+        for k in range(stops):
+            moving = pulp.lpSum((problem.dima[self.arcs[a][1], self.arcs[a][2]] + problem.wait_times[self.arcs[a][1]])
+                                * z[a] for a in stop_arcs[k])
+            name = "time_{}".format(k)
+            m += (t[k + 1] - t[k] - moving == 0, name)
+            self.time_constrs.append(name)
+        for k in range(problem.bar_num):
+            m += t[k] >= pulp.lpSum(problem.open_times[i] * z[a] for i in range(n) for a in position[k][i])
+            m += t[k] <= pulp.lpSum(problem.close_times[i] * z[a] for i in range(n) for a in position[k][i])
+        m += pulp.lpSum(problem.wait_times[i] * y[i] for i in range(n)) <= problem.max_total_wait
+
+        self.model = m
+        self.y = y
+        self.z = z
+        self.exclusions = []
+        self.set_max_walking_time(total_max_walking_time)
+
+    @classmethod
+    def available(cls):
+        return pulp is not None and bool(pulp.PULP_CBC_CMD(msg=False).available())
+
+    def set_max_walking_time(self, total_max_walking_time):
+        super().set_max_walking_time(total_max_walking_time)
+        # constraints are stored as expression + constant, so the constant is minus the right-hand side
+        self.model.constraints["walk"].constant = -total_max_walking_time
+        time_spent_each_bar = self.problem.time_spent_each_bar(total_max_walking_time)
+        for name in self.time_constrs:
+            self.model.constraints[name].constant = -time_spent_each_bar
+
+    def set_start(self, route):
+        # CBC reads the unset variables as 0
+        route_arcs = set(zip(range(len(route)), route[:-1], route[1:]))
+        for arc, variable in zip(self.arcs, self.z):
+            variable.setInitialValue(1 if arc in route_arcs else 0)
+        for i, variable in enumerate(self.y):
+            variable.setInitialValue(1 if i in route else 0)
+
+    def set_time_limit(self, seconds):
+        self.time_limit = min(self.max_time_limit, seconds)
+
+    def exclude_bars(self, bars, max_shared):
+        name = "exclude_{}".format(len(self.exclusions))
+        self.model += (pulp.lpSum(self.y[i] for i in bars) <= max_shared, name)
+        self.exclusions.append(name)
+
+    def clear_exclusions(self):
+        for name in self.exclusions:
+            del self.model.constraints[name]
+        self.exclusions = []
+
+    def solve(self):
+        print("Start optimizing")
+        self.model.solve(pulp.PULP_CBC_CMD(msg=False, timeLimit=self.time_limit, threads=self.threads,
+                                           warmStart=True))
+        # keep the incumbent as the start of the next budget
+        if self.status() in (OPTIMAL, FEASIBLE):
+            for variable in self.z + self.y:
+                variable.setInitialValue(round(variable.value()))
+
+    def status(self):
+        if self.model.sol_status == pulp.LpSolutionOptimal:
+            return OPTIMAL
+        if self.model.sol_status == pulp.LpSolutionIntegerFeasible:
+            return FEASIBLE
+        if self.model.sol_status == pulp.LpSolutionInfeasible:
+            return INFEASIBLE
+        return NO_SOLUTION
+
+    def route(self):
+        if self.status() not in (OPTIMAL, FEASIBLE):
+            return None
+        selected = np.nonzero(np.array([variable.value() or 0 for variable in self.z]) > 0.5)[0]
+        return [int(self.arc_i[selected[0]])] + self.arc_j[selected].tolist()
+
+
+class HeuristicBackend(RouteBackend):
+    """
+    License-free beam search and local search (see models.heuristic). Routes are feasible but not proven optimal.
+    """
+
+    def __init__(self, problem, total_max_walking_time, threads=None, beam_width=100):
+        super().__init__(problem, total_max_walking_time, threads)
+        self.beam_width = beam_width
+        self.start_route = None
+        self._route = None
+
+    def set_start(self, route):
+        self.start_route = route
+
+    def solve(self):
+        routes = [heuristic_route(self.problem, self.total_max_walking_time, self.beam_width)]
+        if best_route(self.problem, [self.start_route], self.total_max_walking_time) is not None:
+            routes.append(improve_route(self.problem, list(self.start_route), self.total_max_walking_time))
+        self._route = best_route(self.problem, routes, self.total_max_walking_time)
+
+    def status(self):
+        return FEASIBLE if self._route is not None else NO_SOLUTION
+
+    def route(self):
+        return self._route
+
+
+class DPBackend(RouteBackend):
+    """
+    Exact label-setting solver (see models.dp), seeded with heuristic routes. Sweeps all budgets in a single pass.
+    """
+
+    def __init__(self, problem, total_max_walking_time, threads=None):
+        super().__init__(problem, total_max_walking_time, threads)
+        self._route = None
+
+    def solve(self):
+        budget = self.total_max_walking_time * 60
+        self._route = self.solve_budgets([budget]).get(budget)
+
+    def status(self):
+        return OPTIMAL if self._route is not None else INFEASIBLE
+
+    def route(self):
+        return self._route
+
+    def solve_budgets(self, budgets, adaptive=True, starts=None, on_route=None, deadline=None):
+        # a single pass answers every budget, adaptive or not, and is not cut by the deadline
+        print("Running exact Pareto for max walking times {}".format(budgets))
+        incumbents = {budget: best_route(self.problem, [heuristic_route(self.problem, budget / 60),
+                                                        (starts or {}).get(budget)], budget / 60)
+                      for budget in budgets}
+        routes = dp_pareto_routes(self.problem, budgets, incumbents)
+        if on_route is not None:
+            for budget in budgets:
+                if budget in routes:
+                    on_route(budget, routes[budget], True)
+        return routes
+
+
+def best_route(problem, routes, total_max_walking_time):
+    """
+    :param routes: candidate routes, None or with None bars for the ones missing
+    :return: The feasible route with the best rating, then the least walking, or None
+    """
+    feasible = [route for route in routes
+                if route is not None and None not in route and problem.is_feasible(route, total_max_walking_time)]
+    if not feasible:
+        return None
+    return max(feasible, key=lambda route: (problem.rating(route), -problem.walking_time(route)))
+
+
+BACKENDS = {'gurobi': GurobiBackend, 'pulp': PulpBackend, 'heuristic': HeuristicBackend, 'dp': DPBackend}
+
+
+def accepts_options(backend_class, options):
+    """
+    :param options: backend keyword argument names
+    :return: Whether the constructor of backend_class takes all of them
+    """
+    parameters = inspect.signature(backend_class.__init__).parameters
+    return all(name in parameters for name in options)
+
+
+def choose_backend(problem, max_dp_bars=40, max_dp_stops=6, options=()):
+    """
+    Picks a backend from the problem size and the solvers available: the exact DP for small crawls, then Gurobi,
+    then CBC, then the heuristic. Backends that do not take the given options are skipped.
+    :param problem: CrawlProblem
+    :param options: names of the backend keyword arguments the backend has to take (e.g. ['timing'])
+    :return: A key of BACKENDS
+    """
+    names = []
+    if len(problem.ratings) <= max_dp_bars and problem.bar_num <= max_dp_stops:
+        names.append('dp')
+    names += [name for name in ['gurobi', 'pulp'] if BACKENDS[name].available()]
+    names.append('heuristic')
+    for name in names:
+        if accepts_options(BACKENDS[name], options):
+            return name
+    raise ValueError("No available backend takes the options {}".format(sorted(options)))
+
+
+def get_backend(solver, problem, total_max_walking_time, threads=None, **options):
+    """
+    :param solver: a key of BACKENDS, or 'auto' (see choose_backend)
+    :param options: backend specific keyword arguments
+    :return: A RouteBackend built for total_max_walking_time
+    """
+    if solver == 'auto':
+        solver = choose_backend(problem, options=options)
+        print("Using the {} backend".format(solver))
+    return BACKENDS[solver](problem, total_max_walking_time, threads, **options)
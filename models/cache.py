@@ -0,0 +1,160 @@
+# Cache of crawl_model results: an in-process LRU tier in front of an on-disk tier
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from models.processing import get_day_of_week
+
+# route options that change how fast the routes are found, not which routes
+IGNORED_OPTIONS = ['workers', 'warm_starts']
+
+# part of every key: bump it whenever Solution or the routes the solvers return change, so that the entries written by
+# earlier code are never read again
+CACHE_VERSION = 2
+
+
+def data_version(paths):
+    """
+    :param paths: data artifacts the results are computed from
+    :return: (path, modification time, size) of each file, which changes whenever one of them is rewritten
+    """
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append((os.path.abspath(path), None, None))
+    return tuple(version)
+
+
+def query_key(date, closest_bar_id, min_review_ct, min_rating, budget_range, start_time, end_time, bar_num,
+              total_max_walking_time, max_walking_each, max_total_wait, create_clusters, version, route_options):
+    """
+    Normalizes a crawl_model query: only the weekday of the date matters to the filters, the start point is replaced by
+    its closest bar and the times are rounded to the second. The key also holds CACHE_VERSION.
+    :param version: data_version of the artifacts used
+    :param route_options: get_pareto_routes keyword arguments
+    :return: A hex digest identifying the query
+    """
+    options = sorted((name, repr(value)) for name, value in route_options.items() if name not in IGNORED_OPTIONS)
+    key = (CACHE_VERSION, get_day_of_week(date), closest_bar_id, int(min_review_ct), round(float(min_rating), 3),
+           tuple(sorted(int(budget) for budget in budget_range)), round(float(start_time) * 3600),
+           round(float(end_time) * 3600), int(bar_num), round(float(total_max_walking_time) * 3600),
+           round(float(max_walking_each) * 3600), round(float(max_total_wait) * 3600), bool(create_clusters),
+           version, tuple(options))
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+class SolutionCache:
+    """
+    Pareto lists by query key. The in-process tier keeps the max_entries most recently used ones. The on-disk tier
+    (one pickle per key) is trimmed to max_disk_bytes, least recently used files first.
+    """
+
+    def __init__(self, directory='data/cache', max_entries=128, max_disk_bytes=50 * 1024 * 1024):
+        """
+        :param directory: on-disk tier, None to keep the cache in memory only
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        # the in-process tier is shared by the threads of crawl_model_stream
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """
+        :return: The cached list of Solutions, or None
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+        if self.directory is None:
+            return None
+
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as handle:
+                solutions = pickle.load(handle)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # mark it as recently used for the disk eviction, unless another process has removed it since
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.add_to_memory(key, solutions)
+        return solutions
+
+    def set(self, key, solutions):
+        self.add_to_memory(key, solutions)
+        if self.directory is None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        # write to a file of its own then rename, so a reader never sees half a file and concurrent writers of the
+        # same key do not share a temporary file
+        descriptor, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as handle:
+                pickle.dump(solutions, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def add_to_memory(self, key, solutions):
+        with self.lock:
+            self.memory[key] = solutions
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def evict(self):
+        """
+        Removes the least recently used files until the on-disk tier fits in max_disk_bytes. Entries of older data
+        versions are never read again, so they age out first. Files that other writers remove in the meantime are
+        skipped.
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for mtime, size, name in files)
+        for mtime, size, name in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.pkl'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+
+# Shared by the queries of this process
+SOLUTION_CACHE = SolutionCache()
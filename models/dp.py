@@ -0,0 +1,114 @@
+# Exact label-setting solver for small crawls, returning the whole walking time / rating frontier in one pass
+import numpy as np
+
+
+def dp_pareto_routes(problem, budgets, incumbents=None):
+    """
+    Extends partial routes (labels) one stop at a time. Because the time spent in each bar depends on the walking
+    budget, every label carries the set of budgets (as a bit mask) it is still feasible for, so a single pass answers
+    all of them. Labels are pruned when:
+    - no budget is left in their mask
+    - their rating plus the best ratings still available cannot beat the incumbent of any budget in their mask
+    - another label through the same bars, ending at the same bar, walks less, is feasible for a superset of their
+    budgets and can only arrive earlier at the remaining bars without any of them being still closed
+    :param problem: CrawlProblem
+    :param budgets: walking time budgets in minutes
+    :param incumbents: optional {budget: route} of known feasible routes (e.g. from the heuristic), used for pruning
+    :return: {budget: best route as a list of bar indices}, for the budgets with a feasible route
+    """
+    n = len(problem.ratings)
+    stops = problem.bar_num - 1
+    budget_hours = np.array(budgets, dtype=float) / 60
+    spent = np.array([problem.time_spent_each_bar(b) for b in budget_hours])
+    bits = 1 << np.arange(len(budgets), dtype=object)
+
+    best = {}
+    best_rating = np.full(len(budgets), -np.inf)
+    best_walk = np.full(len(budgets), np.inf)
+    for b, budget in enumerate(budgets):
+        route = (incumbents or {}).get(budget)
+        if route is not None and problem.is_feasible(route, budget_hours[b]):
+            best[budget] = list(route)
+            best_rating[b] = problem.rating(route)
+            best_walk[b] = problem.walking_time(route)
+
+    # best possible rating of the remaining stops, ignoring every other constraint
+    top_ratings = np.concatenate([[0], np.cumsum(np.sort(problem.ratings)[::-1])])
+
+    def to_mask(feasible):
+        return int(bits[feasible].sum()) if feasible.any() else 0
+
+    def bound_mask(mask, rating, remaining):
+        # drop the budgets this label can no longer improve on
+        hopeless = rating + top_ratings[remaining] <= best_rating + 1e-9
+        return mask & ~to_mask(hopeless)
+
+    # labels: (route, walk, moved (walk + wait before the current bar), wait, rating, budget mask)
+    firsts = [problem.start] if problem.start is not None else range(n)
+    labels = []
+    for i in firsts:
+        feasible = (problem.open_times[i] <= problem.start_time <= problem.close_times[i]) \
+            & (problem.wait_times[i] <= problem.max_total_wait) \
+            & (problem.start_time + stops * spent <= problem.end_time)
+        mask = bound_mask(to_mask(feasible), problem.ratings[i], stops)
+        if mask:
+            labels.append(((i,), 0.0, 0.0, problem.wait_times[i], problem.ratings[i], mask))
+
+    for k in range(stops):
+        extended = {}
+        for route, walk, moved, wait, rating, mask in labels:
+            i = route[-1]
+            in_mask = (mask & bits).astype(bool)
+            times = problem.start_time + (k + 1) * spent[:, None] + moved + problem.dima[i] + problem.wait_times[i]
+            feasible = in_mask[:, None] \
+                & (walk + problem.dima[i] <= budget_hours[:, None]) \
+                & (times >= problem.open_times) & (times <= problem.close_times) \
+                & (times + (stops - k - 1) * spent[:, None] <= problem.end_time)
+            candidates = feasible.any(axis=0) & (problem.dima[i] <= problem.max_walking_each) \
+                & (wait + problem.wait_times <= problem.max_total_wait)
+            candidates[list(route)] = False
+
+            for j in np.nonzero(candidates)[0]:
+                new_rating = rating + problem.ratings[j]
+                new_mask = bound_mask(to_mask(feasible[:, j]), new_rating, stops - k - 1)
+                if not new_mask:
+                    continue
+                label = (route + (int(j),), walk + problem.dima[i, j],
+                         moved + problem.dima[i, j] + problem.wait_times[i], wait + problem.wait_times[j], new_rating,
+                         new_mask)
+                key = (frozenset(label[0]), label[0][-1])
+                extended[key] = add_label(problem, extended.get(key, []), label, spent, k + 1)
+        labels = [label for same_key in extended.values() for label in same_key]
+
+        if not labels:
+            break
+
+    # best rating for each budget, then least walking
+    for route, walk, moved, wait, rating, mask in labels:
+        if len(route) != problem.bar_num:
+            continue
+        for b, budget in enumerate(budgets):
+            if mask & int(bits[b]) and (rating > best_rating[b] + 1e-9
+                                        or (rating > best_rating[b] - 1e-9 and walk < best_walk[b])):
+                best[budget] = list(route)
+                best_rating[b] = rating
+                best_walk[b] = walk
+    return best
+
+
+def add_label(problem, labels, label, spent, stop):
+    """
+    Adds label to the labels sharing its bars and last bar, unless one of them dominates it
+    :return: The updated list of labels
+    """
+    def dominates(a, b):
+        # a reaches every later bar earlier than b: only harmless if none of the remaining bars opens after that
+        remaining = np.ones(len(problem.ratings), dtype=bool)
+        remaining[list(a[0])] = False
+        latest_open = problem.open_times[remaining].max() if remaining.any() else -np.inf
+        earliest = problem.start_time + (stop + 1) * spent.min() + a[2]
+        return a[1] <= b[1] and (b[5] & ~a[5]) == 0 and (a[1] == b[1] or latest_open <= earliest)
+
+    if any(dominates(other, label) for other in labels):
+        return labels
+    return [other for other in labels if not dominates(label, other)] + [label]
@@ -0,0 +1,336 @@
+# Gurobi formulation of the route problem
+import time
+import numpy as np
+import scipy.sparse as sp
+from gurobipy import *
+from models.problem import CrawlProblem, get_arcs
+
+
+def arc_matrix(rows, cols, shape, values=None):
+    """
+    Sparse constraint matrix over the movement variables
+    :param rows: row index of each entry
+    :param cols: arc (column) index of each entry
+    :param shape: (row count, arc count)
+    :param values: value of each entry (default 1), duplicate entries are summed
+    :return: CSR matrix
+    """
+    if values is None:
+        values = np.ones(len(rows))
+    return sp.csr_matrix((values, (rows, cols)), shape=shape)
+
+
+class RouteModel:
+    """
+    Gurobi route model that is built once and re-solved for several total walking time budgets
+    """
+
+    def __init__(self, problem, total_max_walking_time, sparse=False, formulation='bigm', timing=False, env=None,
+                 lazy=False):
+        """
+        The movement variables z form one vector with an entry per (stop, from, to) arc listed by get_arcs, and every
+        constraint is added as a sparse matrix over it.
+        :param problem: CrawlProblem
+        :param total_max_walking_time: largest walking time budget the model will be solved for
+        :param sparse: only create the movement variables that can be part of a feasible route (see get_arcs)
+        :param formulation: 'bigm' links y to the movements with big-M bounds and cumulative time sums. 'flow' ties
+        each selected bar to exactly one position of the route and tracks the arrival time at each stop with a variable
+        :param timing: print the build time, and the solve time after each optimize call
+        :param env: Gurobi environment to build the model in (default environment if None)
+        :param lazy: 'bigm' only. The sequencing and time window rows are left out of the model and a callback adds
+        the ones an incumbent breaks as lazy constraints
+        """
+        if lazy and formulation != 'bigm':
+            raise ValueError("Lazy constraints are only available with the 'bigm' formulation")
+        print("start Gurobi")
+        build_start = time.time()
+        # parameters
+        bigm = 999999
+        m = Model("opt_route", env=env)
+        n = len(problem.ratings)
+        bar_num = problem.bar_num
+        stops = bar_num - 1
+        ratings = problem.ratings
+        open_times = problem.open_times
+        close_times = problem.close_times
+        wait_times = problem.wait_times
+        dima = problem.dima
+        start_time = problem.start_time
+        end_time = problem.end_time
+
+        self.problem = problem
+        self.timing = timing
+        self.lazy = lazy
+        # called with the route of each new incumbent during optimize
+        self.on_incumbent = None
+        # no-good cuts added by exclude_bars
+        self.exclusions = []
+
+        # The time spent in each bar shrinks as the walking budget grows, so pruning with the largest budget keeps
+        # every arc any smaller budget could use
+        time_spent_each_bar = problem.time_spent_each_bar(total_max_walking_time)
+
+        arc_k, arc_i, arc_j = get_arcs(dima, open_times, close_times, wait_times, start_time, end_time, bar_num,
+                                       problem.max_walking_each, problem.max_total_wait, time_spent_each_bar, sparse)
+        arc_count = len(arc_k)
+        arcs = np.arange(arc_count)
+        walk = dima[arc_i, arc_j]
+        moving = walk + wait_times[arc_i]
+        # the last move also places its destination at the final position
+        last = arcs[arc_k == stops - 1]
+
+        # create decision variables
+        # no movements between the same bar
+        y = m.addMVar(n, vtype=GRB.BINARY, name="y")
+        z = m.addMVar(arc_count, vtype=GRB.BINARY, ub=(arc_i != arc_j).astype(float), name="z")
+        print("{} movement variables".format(arc_count))
+
+        # moves out of / into bar i at stop k, on row k * n + i
+        out_matrix = arc_matrix(arc_k * n + arc_i, arcs, (stops * n, arc_count))
+        in_matrix = arc_matrix(arc_k * n + arc_j, arcs, (stops * n, arc_count))
+        stop_matrix = arc_matrix(arc_k, arcs, (stops, arc_count))
+
+        ### objective function
+        m.setObjective(ratings @ y, GRB.MAXIMIZE)
+
+        ### constraints
+        # Number of locations visited
+        m.addConstr(y.sum() == bar_num)
+
+        # max total walk time, the only right-hand side that changes along the Pareto sweep
+        self.walk_constr = m.addConstr(walk @ z <= total_max_walking_time)
+
+        # max walk time between locations
+        m.addConstr(arc_matrix(arc_k, arcs, (stops, arc_count), walk) @ z
+                    <= np.full(stops, problem.max_walking_each))
+
+        # Add starting location
+        if problem.start is not None:
+            m.addConstr(y[problem.start] == 1)
+            m.addConstr(out_matrix[problem.start] @ z == 1)
+
+        # can only have one 1 per movement matrix
+        m.addConstr(stop_matrix @ z == np.ones(stops))
+
+        # Constraints whose right-hand side is rhs - stops * time_spent_each_bar, as (constraint, rhs, stops)
+        self.timed_constrs = []
+        # Rows the callback checks when lazy, as (matrix, sense, rhs, stops) with the same right-hand side rule
+        self.lazy_rows = []
+
+        def add_rows(matrix, sense, rhs, stops_before):
+            if lazy:
+                self.lazy_rows.append((matrix.tocsr(), sense, rhs, stops_before))
+                return None
+            if sense == GRB.EQUAL:
+                return m.addConstr(matrix @ z == rhs - stops_before * time_spent_each_bar)
+            if sense == GRB.GREATER_EQUAL:
+                return m.addConstr(matrix @ z >= rhs - stops_before * time_spent_each_bar)
+            return m.addConstr(matrix @ z <= rhs - stops_before * time_spent_each_bar)
+
+        # have to start from the bar you previously went to
+        if stops > 1:
+            add_rows(in_matrix[:-n] - out_matrix[n:], GRB.EQUAL, np.zeros((stops - 1) * n), 0)
+
+        # open / close time of the bar at each position: the origin of move k, or the destination of the last move
+        position_rows = np.concatenate([arc_k, np.full(len(last), stops)])
+        position_arcs = np.concatenate([arcs, last])
+        position_open = arc_matrix(position_rows, position_arcs, (bar_num, arc_count),
+                                   np.concatenate([open_times[arc_i], open_times[arc_j[last]]]))
+        position_close = arc_matrix(position_rows, position_arcs, (bar_num, arc_count),
+                                    np.concatenate([close_times[arc_i], close_times[arc_j[last]]]))
+
+        position_stops = np.arange(bar_num)
+
+        if formulation == 'flow':
+            # a selected bar holds exactly one position, so it has one incoming and one outgoing move (start and end
+            # excepted) and is never visited twice
+            positions = arc_matrix(np.concatenate([arc_i, arc_j[last]]), position_arcs, (n, arc_count))
+            m.addConstr(y - positions @ z == np.zeros(n))
+
+            # arrival time at each stop
+            t = m.addMVar(bar_num, lb=start_time, ub=end_time, name="t")
+            m.addConstr(t[0] == start_time)
+            step = sp.diags([-np.ones(stops), np.ones(stops)], [0, 1], shape=(stops, bar_num), format='csr')
+            c = m.addConstr(step @ t - arc_matrix(arc_k, arcs, (stops, arc_count), moving) @ z
+                            == np.full(stops, time_spent_each_bar))
+            self.timed_constrs.append((c, np.zeros(stops), -np.ones(stops)))
+
+            # open and close times of the bar at each stop
+            m.addConstr(t - position_open @ z >= np.zeros(bar_num))
+            m.addConstr(t - position_close @ z <= np.zeros(bar_num))
+        else:
+            # froms/tos upper and lower bound
+            touched = arc_matrix(np.concatenate([arc_i, arc_j]), np.concatenate([arcs, arcs]), (n, arc_count))
+            m.addConstr(touched @ z - bigm * y <= np.zeros(n))
+            m.addConstr(touched @ z - y / bigm >= np.zeros(n))
+
+            # make sure we don't vist the same bar twice
+            m.addConstr(arc_matrix(arc_i, arcs, (n, arc_count)) @ z <= np.ones(n))
+            m.addConstr(arc_matrix(arc_j, arcs, (n, arc_count)) @ z <= np.ones(n))
+
+            # time spent moving (walking + waiting) before each stop
+            before = [arcs[arc_k < zed] for zed in range(bar_num)]
+            moved_before = arc_matrix(np.repeat(position_stops, [len(b) for b in before]), np.concatenate(before),
+                                      (bar_num, arc_count), np.concatenate([moving[b] for b in before]))
+
+            # open and close time - only distance is considered for the time being
+            start_rhs = np.full(bar_num, -start_time)
+            for matrix, sense, rhs, stops_before in [
+                    (moved_before - position_open, GRB.GREATER_EQUAL, start_rhs, position_stops),
+                    (moved_before - position_close, GRB.LESS_EQUAL, start_rhs, position_stops),
+                    # Must exit last bar before close time
+                    (moved_before[stops], GRB.LESS_EQUAL, np.array([end_time - start_time]), np.array([stops]))]:
+                c = add_rows(matrix, sense, rhs, stops_before)
+                if c is not None:
+                    self.timed_constrs.append((c, rhs, stops_before))
+
+        # Total wait time less than max allowed
+        m.addConstr(wait_times @ y <= problem.max_total_wait)
+        #m.setParam('OutputFlag', 0)  # Also dual_subproblem.params.outputflag = 0
+        m.setParam('TimeLimit', 30)
+        m.setParam('MIPFocus', 1)
+        #m.setParam('MIPGapAbs', 0.09*bar_num)
+
+        if lazy:
+            m.setParam('LazyConstraints', 1)
+
+        self.model = m
+        self.y = y
+        self.z = z
+        self.z_vars = z.tolist()
+        self.arc_k, self.arc_i, self.arc_j = arc_k, arc_i, arc_j
+        self.arcs = list(zip(arc_k.tolist(), arc_i.tolist(), arc_j.tolist()))
+        self.arc_index = {arc: a for a, arc in enumerate(self.arcs)}
+        self.set_max_walking_time(total_max_walking_time)
+        m.update()
+        self.build_time = time.time() - build_start
+        self.solve_time = 0
+        if timing:
+            print("Built route model in {:.3f}s".format(self.build_time))
+
+    def set_max_walking_time(self, total_max_walking_time):
+        """
+        Moves the model to another total walking time budget. Only right-hand sides change, so Gurobi keeps the
+        previous solution as a MIP start for the next optimize call.
+        :param total_max_walking_time: in hours, at most the budget the model was built with
+        """
+        time_spent_each_bar = self.problem.time_spent_each_bar(total_max_walking_time)
+        self.time_spent_each_bar = time_spent_each_bar
+        self.walk_constr.RHS = total_max_walking_time
+        for c, rhs, stops in self.timed_constrs:
+            c.RHS = rhs - stops * time_spent_each_bar
+
+    def set_start(self, route):
+        """
+        MIP start for the next optimize calls. Only the variables of the route are set, Gurobi completes the rest.
+        :param route: bar index at each stop, None for the bars that are not candidates of this model
+        """
+        y_start = np.full(len(self.problem.ratings), GRB.UNDEFINED)
+        z_start = np.full(len(self.arcs), GRB.UNDEFINED)
+        for i in route:
+            if i is not None:
+                y_start[i] = 1
+        for k, (i, j) in enumerate(zip(route[:-1], route[1:])):
+            if (k, i, j) in self.arc_index:
+                z_start[self.arc_index[(k, i, j)]] = 1
+        self.y.Start = y_start
+        self.z.Start = z_start
+
+    def exclude_bars(self, bars, max_shared):
+        """
+        No-good cut on the bars of a route: the next solves only accept routes sharing at most max_shared of them. The
+        cut stays in the model until clear_exclusions.
+        :param bars: list of bar indices
+        """
+        self.exclusions.append(self.model.addConstr(self.y[list(bars)].sum() <= max_shared))
+
+    def clear_exclusions(self):
+        for c in self.exclusions:
+            self.model.remove(c)
+        self.exclusions = []
+
+    def route(self, z_values):
+        """
+        :param z_values: value of each movement variable
+        :return: The bars of the selected arcs in visiting order (arcs are sorted by stop)
+        """
+        selected = np.nonzero(z_values > 0.5)[0]
+        return [int(self.arc_i[selected[0]])] + self.arc_j[selected].tolist()
+
+    def callback(self, model, where):
+        """
+        On each new incumbent: adds the lazy rows it breaks, or reports it to on_incumbent if it is accepted
+        """
+        if where != GRB.Callback.MIPSOL:
+            return
+        z_values = np.array(model.cbGetSolution(self.z_vars))
+        if self.lazy and self.add_lazy_rows(model, z_values):
+            return
+        if self.on_incumbent is not None:
+            self.on_incumbent(self.route(z_values))
+
+    def add_lazy_rows(self, model, z_values):
+        """
+        Adds the lazy rows the incumbent breaks, with the right-hand side of the current budget
+        :return: True if any row was added
+        """
+        added = False
+        for matrix, sense, rhs, stops in self.lazy_rows:
+            activity = matrix @ z_values
+            bound = rhs - stops * self.time_spent_each_bar
+            if sense == GRB.EQUAL:
+                violated = np.abs(activity - bound) > 1e-6
+            elif sense == GRB.GREATER_EQUAL:
+                violated = activity < bound - 1e-6
+            else:
+                violated = activity > bound + 1e-6
+            for r in np.nonzero(violated)[0]:
+                row = matrix.getrow(r)
+                expr = LinExpr(row.data.tolist(), [self.z_vars[a] for a in row.indices])
+                if sense == GRB.EQUAL:
+                    model.cbLazy(expr == bound[r])
+                elif sense == GRB.GREATER_EQUAL:
+                    model.cbLazy(expr >= bound[r])
+                else:
+                    model.cbLazy(expr <= bound[r])
+                added = True
+        return added
+
+    def optimize(self):
+        print("Start optimizing")
+        solve_start = time.time()
+        if self.lazy or self.on_incumbent is not None:
+            self.model.optimize(self.callback)
+        else:
+            self.model.optimize()
+        self.solve_time = time.time() - solve_start
+        if self.timing:
+            print("Solved route model in {:.3f}s".format(self.solve_time))
+        return self.model
+
+
+def get_optimal_route(df, start_time, end_time, bar_num, total_max_walking_time, max_walking_each, max_total_wait, dima,
+                      closest_bar_id, start_route=None, sparse=False, formulation='bigm', timing=False, lazy=False):
+    """
+    Builds and solves a route model for a single walking time budget
+    :param df:
+    :param start_time:
+    :param end_time:
+    :param bar_num:
+    :param total_max_walking_time:
+    :param max_walking_each:
+    :param start_route: MIP start, as the position in df of the bar at each stop (see RouteModel.set_start)
+    :param sparse: see RouteModel
+    :param formulation: see RouteModel
+    :param timing: see RouteModel
+    :param lazy: see RouteModel
+    :return: The Gurobi model, the y variables and the z variables (MVars, z indexed like RouteModel.arcs)
+    """
+    problem = CrawlProblem.from_df(df, dima, start_time, end_time, bar_num, max_walking_each, max_total_wait,
+                                   closest_bar_id)
+    route_model = RouteModel(problem, total_max_walking_time, sparse, formulation, timing, lazy=lazy)
+    if start_route:
+        route_model.set_start(start_route)
+
+    m = route_model.optimize()
+    return m, route_model.y, route_model.z
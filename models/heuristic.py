@@ -0,0 +1,134 @@
+# Gurobi-free route solver: beam search construction followed by local search
+import numpy as np
+
+
+def beam_search_route(problem, total_max_walking_time, beam_width=100):
+    """
+    Builds routes one stop at a time, keeping the beam_width best partial routes (highest rating sum, then least
+    walking) at each stop
+    :param problem: CrawlProblem
+    :param total_max_walking_time: in hours
+    :return: The best complete route found as a list of bar indices, or None
+    """
+    n = len(problem.ratings)
+    spent = problem.time_spent_each_bar(total_max_walking_time)
+
+    if problem.start is not None:
+        firsts = [problem.start]
+    else:
+        firsts = list(range(n))
+    # (route, arrival time at its last bar, walk, wait, rating)
+    beam = [([i], problem.start_time, 0.0, problem.wait_times[i], problem.ratings[i]) for i in firsts
+            if problem.open_times[i] <= problem.start_time <= problem.close_times[i]
+            and problem.wait_times[i] <= problem.max_total_wait]
+
+    for stop in range(1, problem.bar_num):
+        # latest arrival at this stop that still leaves time for the remaining ones
+        latest = problem.end_time - (problem.bar_num - 1 - stop) * spent
+        candidates = []
+        for b, (route, arrival, walk, wait, rating) in enumerate(beam):
+            i = route[-1]
+            times = arrival + spent + problem.dima[i] + problem.wait_times[i]
+            feasible = (problem.dima[i] <= problem.max_walking_each) \
+                & (walk + problem.dima[i] <= total_max_walking_time) \
+                & (wait + problem.wait_times <= problem.max_total_wait) \
+                & (times >= problem.open_times) & (times <= problem.close_times) & (times <= latest)
+            feasible[route] = False
+            for j in np.nonzero(feasible)[0]:
+                candidates.append((rating + problem.ratings[j], -(walk + problem.dima[i, j]), b, j, times[j]))
+        if not candidates:
+            return None
+
+        candidates.sort(reverse=True)
+        next_beam = []
+        seen = set()
+        for rating, neg_walk, b, j, time in candidates:
+            route = beam[b][0] + [int(j)]
+            # partial routes through the same bars ending at the same bar are interchangeable, keep the best one
+            key = (frozenset(route), route[-1])
+            if key in seen:
+                continue
+            seen.add(key)
+            next_beam.append((route, time, -neg_walk, beam[b][3] + problem.wait_times[j], rating))
+            if len(next_beam) == beam_width:
+                break
+        beam = next_beam
+
+    best = max(beam, key=lambda state: (state[4], -state[2]))
+    return best[0]
+
+
+def improve_route(problem, route, total_max_walking_time, max_rounds=50):
+    """
+    Local search on a feasible route. Swaps a bar for a better rated unused one, then reverses segments (2-opt) and
+    moves single bars to shorten the walk. Stops at a local optimum or after max_rounds rounds.
+    :return: The improved route
+    """
+    n = len(problem.ratings)
+    first = 1 if problem.start is not None else 0
+
+    def better(candidate, current):
+        return problem.is_feasible(candidate, total_max_walking_time) and \
+            (problem.rating(candidate), -problem.walking_time(candidate)) > \
+            (problem.rating(current), -problem.walking_time(current))
+
+    for _ in range(max_rounds):
+        improved = False
+
+        # swap a bar for an unused one, best rated first
+        unused = sorted(set(range(n)) - set(route), key=lambda j: -problem.ratings[j])
+        for p in range(first, len(route)):
+            for j in unused:
+                if problem.ratings[j] < problem.ratings[route[p]]:
+                    break
+                candidate = route[:p] + [j] + route[p + 1:]
+                if better(candidate, route):
+                    route = candidate
+                    improved = True
+                    break
+            if improved:
+                break
+        if improved:
+            continue
+
+        # 2-opt: reverse a segment of the route
+        for a in range(first, len(route) - 1):
+            for b in range(a + 1, len(route)):
+                candidate = route[:a] + route[a:b + 1][::-1] + route[b + 1:]
+                if better(candidate, route):
+                    route = candidate
+                    improved = True
+                    break
+            if improved:
+                break
+        if improved:
+            continue
+
+        # move a single bar to another position
+        for a in range(first, len(route)):
+            for b in range(first, len(route)):
+                if a == b:
+                    continue
+                rest = route[:a] + route[a + 1:]
+                candidate = rest[:b] + [route[a]] + rest[b:]
+                if better(candidate, route):
+                    route = candidate
+                    improved = True
+                    break
+            if improved:
+                break
+        if not improved:
+            return route
+    return route
+
+
+def heuristic_route(problem, total_max_walking_time, beam_width=100):
+    """
+    :param problem: CrawlProblem
+    :param total_max_walking_time: in hours
+    :return: A feasible route as a list of bar indices, or None if none was found
+    """
+    route = beam_search_route(problem, total_max_walking_time, beam_width)
+    if route is None:
+        return None
+    return improve_route(problem, route, total_max_walking_time)
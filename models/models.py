@@ -1,10 +1,24 @@
-from models.processing import filter_dataset, load_dataset, dima_filtered, closest_bar
-from dataclasses import dataclass
+from models.processing import filter_dataset, load_dataset, dima_filtered, closest_bar, closest_bars
+from dataclasses import dataclass, field
 from typing import List
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-import pandas as pd
-from gurobipy import *
+import os
+import queue
+import threading
+import time
+import numpy as np
 from models.clustering import get_clusters
+from models.problem import CrawlProblem
+from models.spatial import load_bar_index
+from models.backends import choose_backend, get_backend
+from models.warm_start import WARM_STARTS
+from models.cache import SOLUTION_CACHE, data_version, query_key
+from preprocessing.distance_store import load_distance_store
+
+
+# TODO - remove filter
+MAX_INDEX = 10000
 
 
 @dataclass
@@ -23,185 +37,74 @@ class Solution:
     total_waiting_time: float
     avg_rating: float # Optimal Gurobi obj. function
     max_walking_time: float
+    alternatives: List['Solution'] = field(default_factory=list)  # next best diverse routes, best first
 
 
-def set_seed(model_1_y, model_1_z):
-    model_2_y = model_1_y
-    model_2_z = model_1_z
-    return model_2_y, model_2_z
+def get_budgets(total_max_walking_time):
+    """
+    :param total_max_walking_time: in hours
+    :return: The total walking time budgets of the Pareto sweep, in minutes
+    """
+    if int(total_max_walking_time)*60 > 40:
+        step = 10
+        min_time=20
+    else:
+        step = 5
+        min_time=5
+    return list(range(min_time, int(total_max_walking_time * 60), step))
+
 
-def get_optimal_route(df, start_time, end_time, bar_num, total_max_walking_time, max_walking_each, max_total_wait, dima,
-                      closest_bar_id, y_start, z_start):
+def route_solution(df, problem, route, max_walking_time, alternatives=()):
     """
-    :param df:
-    :param start_time:
-    :param end_time:
-    :param bar_num:
-    :param total_max_walking_time:
-    :param max_walking_each:
-    :return: A Solution class object representing the optimal solution
+    :param df: candidate bars, in the same order as the problem arrays
+    :param problem: CrawlProblem
+    :param route: list of bar indices
+    :param max_walking_time: walking time budget of the route, in minutes
+    :param alternatives: other routes of the same budget, best first
+    :return: The route as a Solution
     """
-    print("start Gurobi")
-    # parameters
-    bigm = 999999
-    m = Model("opt_route")
-    locations = df['name']
-    bar_ids = df['business_id']
-    ratings = df['stars']
-    open_times = df['open']
-    close_times = df['close']
-    wait_times = df['wait_time'] / 60
-
-    #bar_num = bar_num + 1
-
-    time_spent_each_bar = max(0.25, (end_time - start_time - total_max_walking_time - max_total_wait) / bar_num)
-
-    y = []
-    #z = [[[0 for j in range(len(locations))] for i in range(len(locations))] for k in range(bar_num - 1)]
-
-    # create decision variables
-    for loc in bar_ids:
-        y.append(m.addVar(vtype=GRB.BINARY, name="y_{}".format(loc)))
-
-    #for k in range(bar_num - 1):
-    #    for i in range(len(locations)):
-    #        for j in range(len(locations)):
-    #            z[k][i][j] = m.addVar(vtype=GRB.BINARY, name="z_{},{},{}".format(k, locations[i], locations[j]))
-    z = [[[m.addVar(vtype=GRB.BINARY, name="z_{},{},{}".format(k, locations[i], locations[j]))
-           for j in range(len(locations))] for i in range(len(locations))] for k in range(bar_num - 1)]
-
-    ### objective function
-    m.setObjective(quicksum([y[i] * ratings[i] for i in range(len(locations))]), GRB.MAXIMIZE)
-
-    ### constraints
-    # Number of locations visited
-    m.addConstr(quicksum(y) == bar_num)
-
-    # max total walk time
-    m.addConstr(quicksum([z[w][i][j] * dima[i][j]
-                           for i in range(len(locations))
-                          for j in range(len(locations))
-                          for w in range(bar_num - 1)]) <= total_max_walking_time)
-
-    # max walk time between locations
-    for k in range(bar_num - 1):
-        m.addConstr(quicksum([z[k][i][j] * dima[i][j]
-                              for i in range(len(locations))
-                              for j in range(len(locations))]) <= max_walking_each)
-
-    # rules about z
-    # no movements between the same bar
-    for k in range(bar_num - 1):
-        for i in range(len(locations)):
-            m.addConstr(z[k][i][i] == 0)
-
-    # Add starting location
-    if closest_bar_id is not None:
-        for i in range(len(locations)):
-            if bar_ids[i] == closest_bar_id:
-                m.addConstr(y[i] == 1)
-                m.addConstr(quicksum([z[0][i][j] for j in range(len(locations))]) == 1)
-
-    # froms/tos upper bound
-    for i in range(len(locations)):
-        m.addConstr(quicksum([z[k][i][j] for k in range(bar_num - 1) for j in range(len(locations))])
-                    + quicksum([z[k][j][i] for k in range(bar_num - 1) for j in range(len(locations))])
-                    <= bigm * y[i])
-
-    # froms/tos lower bound
-    for i in range(len(locations)):
-        m.addConstr(quicksum([z[k][i][j] for k in range(bar_num - 1) for j in range(len(locations))])
-                    + quicksum([z[k][j][i] for k in range(bar_num - 1) for j in range(len(locations))])
-                    >= y[i] / bigm)
-
-    # can only have one 1 per movement matrix
-    for k in range(bar_num - 1):
-        m.addConstr(quicksum([z[k][i][j] for i in range(len(locations)) for j in range(len(locations))]) == 1)
-
-    # make sure we don't vist the same bar twice
-    # dimension1
-    for i in range(len(locations)):
-        m.addConstr(quicksum([z[k][i][j] for j in range(len(locations)) for k in range(bar_num - 1)]) <= 1)
-
-    # dimension2
-    for j in range(len(locations)):
-        m.addConstr(quicksum([z[k][i][j] for i in range(len(locations)) for k in range(bar_num - 1)]) <= 1)
-
-    # have to start from the bar you previously went to
-
-    for k in range(1, bar_num - 1):
-        for i in range(len(locations)):
-            m.addConstr(quicksum([z[k - 1][j][i]
-                                  for j in range(len(locations))]) == quicksum(
-                [z[k][i][j] for j in range(len(locations))]))
-
-    # open  time - only distance is considered for the time being
-    for zed in range(bar_num - 1):
-        m.addConstr(start_time + zed * time_spent_each_bar + quicksum([z[w][i][j] * (dima[i][j] + wait_times[i])
-                                                                       for i in range(len(locations))
-                                                                       for j in range(len(locations))
-                                                                       for w in range(zed)]) >= quicksum(
-            [open_times[i] * quicksum(z[zed][i])
-             for i in range(len(locations))]))
-
-
-    m.addConstr(start_time + (bar_num - 1) * time_spent_each_bar + quicksum([z[w][i][j] * (dima[i][j] + wait_times[i])
-                                                                   for i in range(len(locations))
-                                                                   for j in range(len(locations))
-                                                                   for w in range(bar_num - 1)]) >=
-                quicksum([open_times[j] * quicksum([z[bar_num - 2][i][j] for i in range(len(locations))])
-                          for j in range(len(locations))]))
-    # Close time constraint
-
-    for zed in range(bar_num - 1):
-        m.addConstr(start_time + zed * time_spent_each_bar + quicksum([z[w][i][j] * (dima[i][j] + wait_times[i])
-                                                                       for i in range(len(locations))
-                                                                       for j in range(len(locations))
-                                                                       for w in range(zed)]) <= quicksum(
-            [close_times[i] * quicksum(z[zed][i])
-             for i in range(len(locations))]))
-
-    m.addConstr(start_time + (bar_num - 1)  * time_spent_each_bar + quicksum([z[w][i][j] * (dima[i][j] + wait_times[i])
-                                                                   for i in range(len(locations))
-                                                                   for j in range(len(locations))
-                                                                   for w in range(bar_num - 1)]) <=
-                quicksum([close_times[j] * quicksum([z[bar_num - 2][i][j] for i in range(len(locations))])
-                          for j in range(len(locations))]))
-
-    # Must exit last bar before close time
-    m.addConstr(start_time + (bar_num - 1) * time_spent_each_bar + quicksum([z[w][i][j] * (dima[i][j] + wait_times[i])
-                                                                   for i in range(len(locations))
-                                                                   for j in range(len(locations))
-                                                                   for w in range(bar_num - 1)]) <= end_time)
-
-    # Total wait time less than max allowed
-    m.addConstr(quicksum([wait_times[i] * y[i] for i in range(len(locations))]) <= max_total_wait)
-    #m.setParam('OutputFlag', 0)  # Also dual_subproblem.params.outputflag = 0
-    m.setParam('TimeLimit', 30)
-    m.setParam('MIPFocus', 1)
-
-    for i in range(len(y_start)):
-        try:
-            y[i].start = y_start[i].x
-        except:
-            y[i].start = y_start[i]
+    rows = df.iloc[route]
+    bars = [Bar(str(bar_id), str(name), float(longitude), float(latitude), str(rating))
+            for bar_id, name, longitude, latitude, rating in zip(rows['business_id'], rows['name'], rows['longitude'],
+                                                                 rows['latitude'], rows['stars'])]
+    return Solution(bars, problem.walking_time(route), problem.waiting_time(route),
+                    problem.rating(route) / problem.bar_num, max_walking_time,
+                    [route_solution(df, problem, alternative, max_walking_time) for alternative in alternatives])
+
+
+def sweep_budgets_worker(args):
+    """
+    Process pool entry point: builds a backend with its own thread cap (and solver environment) and sweeps a chunk of
+    budgets
+    :param args: solver name, CrawlProblem, backend options, the chunk of budgets, adaptive, the warm starts, the
+    deadline, the thread cap of this worker, and the number of alternatives and their minimum number of different bars
+    :return: {budget: route} and {budget: alternative routes}
+    """
+    solver, problem, backend_options, budgets, adaptive, starts, deadline, threads, alternatives, min_different_bars \
+        = args
+    backend = get_backend(solver, problem, max(budgets) / 60, threads, **backend_options)
+    try:
+        routes = backend.solve_budgets(budgets, adaptive, starts, deadline=deadline)
+        return routes, solve_alternatives(backend, routes, alternatives, min_different_bars, deadline)
+    finally:
+        backend.close()
 
-    for i in range(len(y_start)):
-        for j in range(len(y_start)):
-            for k in range(len(z_start)):
-                try:
-                    z[k][i][j].start = z_start[k][i][j].x
-                except:
-                    z[k][i][j].start = z_start[k][i][j]
 
-    #m.setParam('MIPGapAbs', 0.09*bar_num)
-    print("Start optimizing")
-    m.optimize()
-    return m, y, z
+def solve_alternatives(backend, routes, count, min_different_bars, deadline):
+    """
+    :return: {budget: alternative routes}, empty when none are asked or the backend cannot exclude routes
+    """
+    if count <= 0 or not routes:
+        return {}
+    if not backend.supports_exclusions:
+        print("{} does not support alternative routes".format(type(backend).__name__))
+        return {}
+    return backend.solve_alternatives(routes, count, min_different_bars, deadline)
 
 
 def get_pareto_routes(df, start_time, end_time, bar_num, total_max_walking_time, max_walking_each, max_total_wait,
-                      dima, closest_bar_id=None):
+                      dima, closest_bar_id=None, solver='gurobi', workers=None, adaptive=True, warm_starts=WARM_STARTS,
+                      on_solution=None, deadline=None, k_best=1, min_different_bars=1, **backend_options):
     """
     Returns total_max_walking_time / 5 suggested routes (e.g. one for 0-5 mins walk, one for 5-10 mins walk, etc.).
     Pareto routes contain
@@ -211,72 +114,167 @@ def get_pareto_routes(df, start_time, end_time, bar_num, total_max_walking_time,
     :param bar_num:
     :param total_max_walking_time:
     :param max_walking_each:
+    :param solver: a key of models.backends.BACKENDS: 'gurobi' for the route model, 'pulp' for the same model solved
+    with CBC, 'heuristic' for the license-free beam search and local search, which returns good but not necessarily
+    optimal routes, 'dp' for the exact label-setting solver, which answers all budgets in one pass and suits small
+    crawls (a few dozen candidates, up to 6 stops). 'auto' picks one from the problem size and the installed solvers,
+    among those that take backend_options.
+    :param workers: if more than 1, the budgets are split in that many contiguous chunks, each swept by a separate
+    process with its own backend and an equal share of the CPU threads. Warm starts carry over between neighbouring
+    budgets of the same chunk.
+    :param adaptive: order the budgets so that each solve starts from the route of the previous one and the routes
+    that are provably optimal at other budgets are given to them instead of solving them (see
+    RouteBackend.solve_budgets). The Solutions still come one per budget of the grid.
+    :param warm_starts: WarmStartStore the solves start from and the routes found are added to, so a nearby query
+    (same start bar, other budget, rating or times) starts from a route of the previous one. None to start cold.
+    :param on_solution: anytime mode, called as on_solution(solution, final) as soon as a Solution is available:
+    with each improving incumbent of the budget being solved (final False, gurobi only and not with workers), and with
+    the Solution each budget ends up with (final True, per chunk with workers)
+    :param deadline: seconds after which no budget is started and the running solve is stopped. The Solutions found
+    by then are returned.
+    :param k_best: routes wanted per budget. The k_best - 1 next best ones go in Solution.alternatives, found by
+    re-solving the same model after the sweep (see RouteBackend.solve_alternatives, 'gurobi' and 'pulp' only). They are
+    not passed to on_solution.
+    :param min_different_bars: each route of a budget differs from every better one by at least that many bars
+    :param backend_options: passed on to the backend (e.g. sparse, formulation and timing for 'gurobi')
     :return: A list of Solutions
     """
-    solutions = []
-    wait_times = df['wait_time'] / 60
-    last_success = 0
-    if int(total_max_walking_time)*60 > 40:
-        step = 10
-        min_time=20
+    budgets = get_budgets(total_max_walking_time)
+    if deadline is not None:
+        deadline = time.time() + deadline
+    problem = CrawlProblem.from_df(df, dima, start_time, end_time, bar_num, max_walking_each, max_total_wait,
+                                   closest_bar_id)
+    if solver == 'auto':
+        solver = choose_backend(problem, options=backend_options)
+        print("Using the {} backend".format(solver))
+    business_ids = df['business_id'].values
+    starts = warm_starts.get(business_ids, problem.start, budgets) if warm_starts is not None else {}
+
+    on_route = None
+    if on_solution is not None:
+        def on_route(budget, route, final):
+            on_solution(route_solution(df, problem, route, budget), final)
+
+    if workers is None or workers <= 1 or len(budgets) <= 1:
+        # Built once, each budget only updates right-hand sides and re-solves from the previous incumbent
+        backend = get_backend(solver, problem, total_max_walking_time, **backend_options)
+        try:
+            routes = backend.solve_budgets(budgets, adaptive, starts, on_route, deadline)
+            alternatives = solve_alternatives(backend, routes, k_best - 1, min_different_bars, deadline)
+        finally:
+            backend.close()
     else:
-        step = 5
-        min_time=5
-    for max_walking_time in range(min_time, int(total_max_walking_time * 60), step):
-        bars = []
-        print("Running Pareto for max walking time {}".format(max_walking_time))
-        if max_walking_time == min_time or last_success == 0:
-            y_start = [0 for i in range(len(df))]
-            z_start = [[[0 for j in range(len(df))] for i in range(len(df))] for k in range(bar_num - 1)]
-        else:
-            y_start, z_start = set_seed(y_var, z_var)
-        model, y_var, z_var = get_optimal_route(df, start_time, end_time, bar_num, max_walking_time / 60,
-                                               max_walking_each, max_total_wait, dima, closest_bar_id, y_start, z_start)
+        workers = min(workers, len(budgets))
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        chunks = [[int(budget) for budget in chunk] for chunk in np.array_split(budgets, workers)]
+        routes = {}
+        alternatives = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(sweep_budgets_worker,
+                                   (solver, problem, backend_options, chunk, adaptive,
+                                    {budget: starts[budget] for budget in chunk if budget in starts}, deadline,
+                                    threads, k_best - 1, min_different_bars))
+                       for chunk in chunks]
+            for future in as_completed(futures):
+                chunk_routes, chunk_alternatives = future.result()
+                routes.update(chunk_routes)
+                alternatives.update(chunk_alternatives)
+                if on_route is not None:
+                    for budget, route in chunk_routes.items():
+                        on_route(budget, route, True)
+
+    if warm_starts is not None:
+        warm_starts.add(business_ids, problem.start, routes)
+    return [route_solution(df, problem, routes[budget], budget, alternatives.get(budget, ()))
+            for budget in budgets if budget in routes]
+
+
+def get_bars(min_review_ct, min_rating, date, budget_range, csv, start_coord):
+    """
+    Loads the bars that pass the filters and finds the one closest to the starting point
+    :param csv: preprocessed bars CSV
+    :param start_coord: (latitude, longitude) of the starting point, or None
+    :return: The bars data frame and the id of the bar closest to start_coord (None without a start_coord)
+    """
+    df = load_dataset(csv)
+    df = filter_dataset(df, min_review_ct, min_rating, date, budget_range).reset_index()
 
-        locations = len(z_var[0])
-        if model.status in [3,4,5]: # If infeasible or unbounded
-            continue
-        try:
-            obj_val = float(model.objval)
-        except:
-            continue
-        if model.objval < 0 or model.objval > 5*bar_num:
-            continue
-        last_success = 1
-        for k in range(len(z_var)):
-            for i in range(locations):
-                for j in range(locations):
-                    if z_var[k][i][j].x != 0:
-                        if k == 0:
-                            bar_id = y_var[i].VarName[2:]
-                            name = str(df.loc[lambda f: f['business_id'] == bar_id]['name'].values[0])
-                            longitude = float(df.loc[lambda f: f['business_id'] == bar_id]['longitude'].values[0])
-                            latitude = float(df.loc[lambda f: f['business_id'] == bar_id]['latitude'].values[0])
-                            rating = str(df.loc[lambda f: f['business_id'] == bar_id]['stars'].values[0])
-                            bars.append(Bar(bar_id, name, longitude, latitude, rating)) # This is ordered
-
-                        bar_id = y_var[j].VarName[2:]
-                        name = str(df.loc[lambda f: f['business_id'] == bar_id]['name'].values[0])
-                        longitude = float(df.loc[lambda f: f['business_id'] == bar_id]['longitude'].values[0])
-                        latitude = float(df.loc[lambda f: f['business_id'] == bar_id]['latitude'].values[0])
-                        rating = str(df.loc[lambda f: f['business_id'] == bar_id]['stars'].values[0])
-                        bars.append(Bar(bar_id, name, longitude, latitude, rating))  # This is ordered
-
-        total_walk_time = sum([z_var[w][i][j].x * dima[i][j]
-                  for i in range(locations)
-                  for j in range(locations)
-                  for w in range(bar_num - 1)])
-        avg_rating = model.objval/bar_num
-        total_wait = sum([wait_times[i] * y_var[i].x for i in range(locations)])
-
-        best_solution = Solution(bars, total_walk_time, total_wait, avg_rating, max_walking_time)
-        solutions.append(best_solution)
-
-    return solutions
+    length = str(df.shape[0])
+    with open('data/df_length.output', 'w') as filehandle:
+        filehandle.write(length)
+
+    closest_bar_id = None
+    if start_coord is not None:
+        closest_bar_id = closest_bar(df[:MAX_INDEX], start_coord, load_bar_index(csv))
+        print("Closest bar is {}".format(closest_bar_id))
+    return df, closest_bar_id
+
+
+def add_clusters(df, create_clusters):
+    """
+    Adds the cluster of each bar to df (all bars in cluster 0 if create_clusters is False)
+    """
+    if create_clusters:
+        coordinates = list(zip(df.latitude, df.longitude))
+        df['cluster'] = get_clusters(coordinates, df['business_id'])
+    else:
+        df['cluster'] = 0
+    return df
+
+
+def filter_candidates(df, closest_bar_id, total_max_walking_time, distance_csv, create_clusters, bar_index=None):
+    """
+    Keeps the bars of the closest bar's cluster that are within walking distance of it
+    :param df: bars data frame from get_bars
+    :param distance_csv: distance store (see preprocessing.distance_store)
+    :param bar_index: BarIndex of the data set (see models.spatial). If given, only the bars it finds nearby are
+    looked up in the distance store.
+    :return: The candidate bars data frame and their distance matrix
+    """
+    df = add_clusters(df, create_clusters)
+
+    store = load_distance_store(distance_csv)
+
+    print("{} bars before filtering".format(df.shape[0]))
+    if closest_bar_id is not None:
+        closest_bar_cluster = df.loc[lambda f: f['business_id'] == closest_bar_id]['cluster'].min()
+        nearby = None if bar_index is None else bar_index.nearby([closest_bar_id], total_max_walking_time)
+        bars_close_enough = store.within([closest_bar_id], total_max_walking_time, nearby)
+
+        df = df[(df['business_id'].isin(bars_close_enough)) & (df['cluster'] == closest_bar_cluster)
+        ].reset_index()
+
+    dima = dima_filtered(df, store)
+    print("{} bars after filtering".format(df.shape[0]))
+
+    df = df[:MAX_INDEX]
+    return df, dima
+
+
+def get_candidates(min_review_ct, min_rating, date, budget_range, total_max_walking_time, csv, distance_csv,
+                   start_coord, create_clusters):
+    """
+    Loads and filters the bars a crawl can go through
+    :param min_review_ct:
+    :param min_rating:
+    :param date:
+    :param budget_range:
+    :param total_max_walking_time:
+    :param csv: preprocessed bars CSV
+    :param distance_csv: distance store (see preprocessing.distance_store)
+    :param start_coord: (latitude, longitude) of the starting point, or None
+    :param create_clusters:
+    :return: The candidate bars data frame, their distance matrix and the id of the bar closest to start_coord
+    """
+    df, closest_bar_id = get_bars(min_review_ct, min_rating, date, budget_range, csv, start_coord)
+    df, dima = filter_candidates(df, closest_bar_id, total_max_walking_time, distance_csv, create_clusters,
+                                 load_bar_index(csv))
+    return df, dima, closest_bar_id
 
 
 def crawl_model(min_review_ct, min_rating, date, budget_range, start_time, end_time, bar_num, total_max_walking_time,
-                max_walking_each, max_total_wait, csv, distance_csv, start_coord, create_clusters):
+                max_walking_each, max_total_wait, csv, distance_csv, start_coord, create_clusters,
+                cache=SOLUTION_CACHE, on_solution=None, deadline=None, **route_options):
     """
     :param date:
     :param start_time:
@@ -288,46 +286,145 @@ def crawl_model(min_review_ct, min_rating, date, budget_range, start_time, end_t
     :param min_review_ct:
     :param min_review:
     :param city:
+    :param cache: SolutionCache of earlier results, by normalized query (see models.cache.query_key). Entries are
+    invalidated when csv or distance_csv change. None to always solve.
+    :param on_solution: called with Solutions as they are found (see get_pareto_routes), cached ones included
+    :param deadline: seconds the whole query may take, loading included. Results cut by it are not cached.
+    :param route_options: passed on to get_pareto_routes (solver, workers and backend options)
     :return:
     """
+    query_start = time.time()
+    df, closest_bar_id = get_bars(min_review_ct, min_rating, date, budget_range, csv, start_coord)
+
+    if cache is not None:
+        key = query_key(date, closest_bar_id, min_review_ct, min_rating, budget_range, start_time, end_time, bar_num,
+                        total_max_walking_time, max_walking_each, max_total_wait, create_clusters,
+                        data_version([csv, distance_csv]), route_options)
+        solutions = cache.get(key)
+        if solutions is not None:
+            print("Found {} cached routes".format(len(solutions)))
+            if on_solution is not None:
+                for solution in solutions:
+                    on_solution(solution, True)
+            return solutions
+
+    df, dima = filter_candidates(df, closest_bar_id, total_max_walking_time, distance_csv, create_clusters,
+                                 load_bar_index(csv))
 
-    df = load_dataset(csv)
-    df = filter_dataset(df, min_review_ct, min_rating, date, budget_range).reset_index()
-
-    if create_clusters:
-        coordinates = list(zip(df.latitude, df.longitude))
-        df['cluster'] = get_clusters(coordinates, df['business_id'])
-    else:
-        df['cluster'] = 0
-
-    length = str(df.shape[0])
-    with open('data/df_length.output', 'w') as filehandle:
-        filehandle.write(length)
+    print("WALK {}".format(total_max_walking_time))
+    remaining_time = None if deadline is None else max(0, query_start + deadline - time.time())
+    pareto_df = get_pareto_routes(df, start_time, end_time, bar_num, total_max_walking_time, max_walking_each,
+                                  max_total_wait, dima, closest_bar_id, on_solution=on_solution,
+                                  deadline=remaining_time, **route_options)
 
-    dima_df = pd.read_csv(distance_csv, header = 0)
-    max_index = 10000
+    if cache is not None and (deadline is None or time.time() < query_start + deadline):
+        cache.set(key, pareto_df)
+    return pareto_df
 
-    closest_bar_id = None
-    if start_coord is not None:
-        closest_bar_id = closest_bar(df[:max_index], start_coord)
-        closest_bar_cluster = df.loc[lambda f: f['business_id'] == closest_bar_id]['cluster'].min()
 
-        print("Closest bar is {}".format(closest_bar_id))
+def crawl_model_stream(*args, **kwargs):
+    """
+    Anytime crawl_model: runs it in a background thread and yields the Solutions as they are found
+    :param args: crawl_model arguments
+    :param kwargs: crawl_model keyword arguments (e.g. deadline), except on_solution
+    :return: Generator of (Solution, final) pairs, see get_pareto_routes
+    """
+    events = queue.Queue()
+    errors = []
 
-    print("{} bars before filtering".format(df.shape[0]))
-    if closest_bar_id is not None:
-        bars_close_enough = list(dima_df.loc[lambda f: f[closest_bar_id] <= total_max_walking_time]['business_id'])
+    def run():
+        try:
+            crawl_model(*args, on_solution=lambda solution, final: events.put((solution, final)), **kwargs)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        event = events.get()
+        if event is None:
+            break
+        yield event
+    if errors:
+        raise errors[0]
+
+
+def solve_origin(args):
+    """
+    Process pool entry point of crawl_model_batch
+    :param args: get_pareto_routes positional arguments, then its keyword arguments as a dict
+    :return: A list of Solutions
+    """
+    *pareto_args, route_options = args
+    return get_pareto_routes(*pareto_args, **route_options)
 
-        df = df[(df['business_id'].isin(bars_close_enough)) & (df['cluster'] == closest_bar_cluster)
-        ].reset_index()
 
-    dima = dima_filtered(df, dima_df)
-    print("{} bars after filtering".format(df.shape[0]))
+def crawl_model_batch(min_review_ct, min_rating, date, budget_range, start_time, end_time, bar_num,
+                      total_max_walking_time, max_walking_each, max_total_wait, csv, distance_csv, start_coords,
+                      create_clusters, workers=None, cache=SOLUTION_CACHE, **route_options):
+    """
+    crawl_model for many starting points with one parameter set. The bars are loaded, filtered and clustered and the
+    distance store opened once. Starting points with the same closest bar are solved once, and those of the same cluster
+    share one candidate set and distance matrix, from which each takes the bars within walking distance of its start.
+    :param start_coords: list of (latitude, longitude)
+    :param workers: number of processes solving starting points in parallel (serial if None or 1)
+    :param cache: see crawl_model
+    :param route_options: passed on to get_pareto_routes (solver, backend options...)
+    :return: A list of Solutions per starting point, in the order of start_coords
+    """
+    df, _ = get_bars(min_review_ct, min_rating, date, budget_range, csv, None)
+    bar_index = load_bar_index(csv)
+    closest_bar_ids = closest_bars(df[:MAX_INDEX], start_coords, bar_index)
+
+    results = {}
+    keys = {}
+    if cache is not None:
+        version = data_version([csv, distance_csv])
+        for bar_id in set(closest_bar_ids):
+            keys[bar_id] = query_key(date, bar_id, min_review_ct, min_rating, budget_range, start_time, end_time,
+                                     bar_num, total_max_walking_time, max_walking_each, max_total_wait,
+                                     create_clusters, version, route_options)
+            solutions = cache.get(keys[bar_id])
+            if solutions is not None:
+                results[bar_id] = solutions
+    todo = sorted(set(closest_bar_ids) - set(results))
+    print("{} starting points, {} distinct closest bars, {} to solve".format(len(start_coords),
+                                                                             len(set(closest_bar_ids)), len(todo)))
+
+    if todo:
+        df = add_clusters(df, create_clusters)
+        store = load_distance_store(distance_csv)
+        clusters = df.set_index('business_id')['cluster']
+
+        tasks = []
+        for cluster in sorted(set(clusters[todo])):
+            bar_ids = [bar_id for bar_id in todo if clusters[bar_id] == cluster]
+            # bars of the cluster within walking distance of any of its starting bars
+            close_enough = store.within(bar_ids, total_max_walking_time,
+                                        bar_index.nearby(bar_ids, total_max_walking_time))
+            cluster_df = df[(df['business_id'].isin(close_enough)) & (df['cluster'] == cluster)].reset_index()
+            cluster_dima = dima_filtered(cluster_df, store)
+            cluster_ids = cluster_df['business_id'].values
+            print("Cluster {}: {} starting bars, {} candidates".format(cluster, len(bar_ids), len(cluster_df)))
+
+            for bar_id in bar_ids:
+                start = np.nonzero(cluster_ids == bar_id)[0][0]
+                rows = np.nonzero(cluster_dima[:, start] <= total_max_walking_time)[0]
+                origin_df = cluster_df.iloc[rows].reset_index(drop=True)[:MAX_INDEX]
+                origin_dima = cluster_dima[np.ix_(rows, rows)]
+                tasks.append((bar_id, (origin_df, start_time, end_time, bar_num, total_max_walking_time,
+                                       max_walking_each, max_total_wait, origin_dima, bar_id, route_options)))
+
+        if workers is None or workers <= 1 or len(tasks) <= 1:
+            solved = [solve_origin(args) for bar_id, args in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+                solved = list(pool.map(solve_origin, [args for bar_id, args in tasks]))
 
-    # TODO - remove filter
-    df = df[:max_index]
-    print("WALK {}".format(total_max_walking_time))
-    pareto_df = get_pareto_routes(df, start_time, end_time, bar_num, total_max_walking_time, max_walking_each,
-                                  max_total_wait, dima, closest_bar_id)
+        for (bar_id, args), solutions in zip(tasks, solved):
+            results[bar_id] = solutions
+            if cache is not None:
+                cache.set(keys[bar_id], solutions)
 
-    return pareto_df
\ No newline at end of file
+    return [results[bar_id] for bar_id in closest_bar_ids]
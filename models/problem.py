@@ -0,0 +1,140 @@
+# Route problem data shared by the solvers that work on plain arrays instead of a Gurobi model
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+
+def time_spent_each_bar(start_time, end_time, total_max_walking_time, max_total_wait, bar_num):
+    """
+    Time planned in each bar: what is left of the evening once walking and waiting are accounted for
+    :return: Time in hours (at least 15 minutes)
+    """
+    return max(0.25, (end_time - start_time - total_max_walking_time - max_total_wait) / bar_num)
+
+
+@dataclass
+class CrawlProblem:
+    ratings: np.ndarray
+    open_times: np.ndarray
+    close_times: np.ndarray
+    wait_times: np.ndarray  # hours
+    dima: np.ndarray  # walking time between bars, hours
+    start_time: float
+    end_time: float
+    bar_num: int
+    max_walking_each: float
+    max_total_wait: float
+    start: Optional[int]  # index of the bar the crawl has to start from
+
+    @classmethod
+    def from_df(cls, df, dima, start_time, end_time, bar_num, max_walking_each, max_total_wait, closest_bar_id):
+        start = None
+        if closest_bar_id is not None:
+            start = int(np.nonzero(df['business_id'].values == closest_bar_id)[0][0])
+        return cls(df['stars'].values.astype(float), df['open'].values.astype(float),
+                   df['close'].values.astype(float), df['wait_time'].values.astype(float) / 60,
+                   np.asarray(dima, dtype=float), start_time, end_time, bar_num, max_walking_each, max_total_wait,
+                   start)
+
+    def time_spent_each_bar(self, total_max_walking_time):
+        return time_spent_each_bar(self.start_time, self.end_time, total_max_walking_time, self.max_total_wait,
+                                   self.bar_num)
+
+    def budgets_nested(self, larger, smaller):
+        """
+        Whether every route feasible within the smaller walking time budget is also feasible within the larger one. A
+        smaller budget leaves more time in each bar, so the bars are reached later, which can also make a bar open by
+        the time it is reached. That cannot happen when both budgets spend the same time in each bar, or when every bar
+        is open by the time the second stop is reached within the larger budget (the first one is reached at the start
+        of the crawl whatever the budget).
+        :param larger: walking time budget, in hours
+        :param smaller: walking time budget, in hours, at most larger
+        """
+        spent = self.time_spent_each_bar(larger)
+        return (spent == self.time_spent_each_bar(smaller)
+                or float(self.open_times.max(initial=self.start_time)) <= self.start_time + spent)
+
+    def rating(self, route):
+        return float(self.ratings[route].sum())
+
+    def rating_bound(self):
+        """
+        :return: Rating of the best rated bars (the start bar included), which no route can beat
+        """
+        if self.start is None:
+            return float(np.sort(self.ratings)[::-1][:self.bar_num].sum())
+        others = np.delete(self.ratings, self.start)
+        return float(self.ratings[self.start] + np.sort(others)[::-1][:self.bar_num - 1].sum())
+
+    def walking_time(self, route):
+        return float(self.dima[route[:-1], route[1:]].sum())
+
+    def waiting_time(self, route):
+        return float(self.wait_times[route].sum())
+
+    def arrival_times(self, route, total_max_walking_time):
+        """
+        Time at which each bar of the route is reached. Every move takes the time spent in the bar, the wait at the
+        bar and the walk to the next one.
+        """
+        spent = self.time_spent_each_bar(total_max_walking_time)
+        times = [self.start_time]
+        for i, j in zip(route[:-1], route[1:]):
+            times.append(times[-1] + spent + self.dima[i, j] + self.wait_times[i])
+        return times
+
+    def is_feasible(self, route, total_max_walking_time):
+        """
+        Checks a route (list of bar indices) against the same rules as the Gurobi route model
+        """
+        if len(route) != self.bar_num or len(set(route)) != self.bar_num:
+            return False
+        if self.start is not None and route[0] != self.start:
+            return False
+        if self.waiting_time(route) > self.max_total_wait + 1e-9:
+            return False
+        walks = self.dima[route[:-1], route[1:]]
+        if (walks > self.max_walking_each + 1e-9).any() or walks.sum() > total_max_walking_time + 1e-9:
+            return False
+        times = np.array(self.arrival_times(route, total_max_walking_time))
+        if times[-1] > self.end_time + 1e-9:
+            return False
+        return bool(((times >= self.open_times[route] - 1e-9) & (times <= self.close_times[route] + 1e-9)).all())
+
+
+def get_arcs(dima, open_times, close_times, wait_times, start_time, end_time, bar_num, max_walking_each,
+             max_total_wait, time_spent_each_bar, sparse=False):
+    """
+    Lists the (stop, from, to) index triples that get a movement variable in the route model
+    :param dima: nxn walking time matrix (hours), infinite for the pairs out of reach (e.g. beyond the radius of a
+    neighbour graph, see preprocessing.distance_store)
+    :param open_times: opening hour of each bar
+    :param close_times: closing hour of each bar
+    :param wait_times: wait time at each bar (hours)
+    :param sparse: if False, every (stop, from, to) triple is returned, but the pairs out of reach. If True, only the
+    moves that can be part of a feasible route are kept: i != j, dima[i][j] <= max_walking_each and reachable within
+    the time windows
+    :return: arrays of stop, from and to indices, sorted by stop
+    """
+    n = len(dima)
+    dima = np.asarray(dima, dtype=float)
+    if not sparse:
+        return np.nonzero(np.broadcast_to(np.isfinite(dima), (bar_num - 1, n, n)))
+
+    open_times = np.asarray(open_times, dtype=float)
+    close_times = np.asarray(close_times, dtype=float)
+    wait_times = np.asarray(wait_times, dtype=float)
+
+    # moves that never depend on the stop index
+    possible = (dima <= max_walking_each) & ~np.eye(n, dtype=bool)
+    possible &= (wait_times[:, None] + wait_times[None, :]) <= max_total_wait
+
+    feasible = np.empty((bar_num - 1, n, n), dtype=bool)
+    for k in range(bar_num - 1):
+        # Earliest time we can be at stop k, and hence leave bar i from it
+        departure = np.maximum(start_time + k * time_spent_each_bar, open_times)
+        arrival = departure[:, None] + time_spent_each_bar + dima + wait_times[:, None]
+        feasible[k] = possible & (departure <= close_times)[:, None]
+        feasible[k] &= arrival <= close_times[None, :]
+        feasible[k] &= arrival + (bar_num - 2 - k) * time_spent_each_bar <= end_time
+    return np.nonzero(feasible)
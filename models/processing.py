@@ -1,7 +1,7 @@
 # On the spot filtering. Different from the one-time preprocessing
 from datetime import datetime
 import pandas as pd
-from preprocessing.business_utils import calculate_distance
+from models.spatial import BarIndex
 
 def load_dataset(csv):
     """
@@ -43,34 +43,32 @@ def filter_dataset(df, min_review_ct, min_rating, date, budget_range):
     return df
 
 
-def dima_filtered(df, dima_df):
-    keep_columns = dima_df.columns
-
-    filtered = pd.merge(dima_df, df, how="inner", on=["business_id"])
-    filtered = filtered[keep_columns]
-
-    keep_columns = filtered.columns
-    filtered = filtered.transpose()
-
-    filtered = filtered.rename(columns=filtered.iloc[0])
-
-    filtered = filtered.drop('business_id')
-    filtered = filtered.reset_index()
-    filtered = filtered.rename(columns={'index': 'business_id'})
-    keep_columns = filtered.columns[1:]
-    filtered = pd.merge(filtered, df, how="inner", on=["business_id"])
-    filtered = filtered[keep_columns]
-
-    dima = filtered.values.tolist()
-    return dima
-
+def dima_filtered(df, store):
+    """
+    Distance matrix of the bars of df, gathered from the store by position
+    :param df: bars data frame
+    :param store: DistanceStore (see preprocessing.distance_store)
+    :return: nxn float array, rows and columns in the order of df
+    """
+    return store.submatrix(df['business_id'])
 
-def closest_bar(df, start_coord):
-    df_cp = df.copy()
 
-    df_cp['dist_from_start'] = df_cp.apply(lambda x: calculate_distance((x['latitude'], x['longitude']), start_coord),
-                                           axis=1)
+def closest_bar(df, start_coord, bar_index=None):
+    """
+    :param df: bars to choose from
+    :param start_coord: (latitude, longitude)
+    :param bar_index: BarIndex covering the bars of df (see models.spatial), built from df if None
+    :return: business_id of the closest bar
+    """
+    return closest_bars(df, [start_coord], bar_index)[0]
 
-    business_id = df_cp.loc[(df_cp.dist_from_start == df_cp.dist_from_start.min()), 'business_id'].values[0]
 
-    return business_id
\ No newline at end of file
+def closest_bars(df, start_coords, bar_index=None):
+    """
+    closest_bar for many starting points at once
+    :param start_coords: list of (latitude, longitude)
+    :return: business_id of the closest bar to each starting point
+    """
+    if bar_index is None:
+        return BarIndex.from_df(df).closest(start_coords)
+    return bar_index.closest(start_coords, df['business_id'])
@@ -0,0 +1,96 @@
+# Spatial index over the bars of a data set, for nearest bar and walking radius queries
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+from preprocessing.business_utils import EARTH_RADIUS_KM, KM_TO_MILE, geodesic_distances
+from preprocessing.store_utils import load_versioned, positions
+
+# the ellipsoid distances are within half a percent of the great-circle ones the index measures
+SPHERE_MARGIN = 1.01
+
+
+class BarIndex:
+    """
+    BallTree of the bars on haversine coordinates. Queries take O(log n) instead of a distance to every bar.
+    """
+
+    def __init__(self, business_ids, latitudes, longitudes):
+        self.business_ids = np.asarray(business_ids, dtype=str)
+        self.index = pd.Index(self.business_ids)
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.tree = BallTree(np.radians(np.column_stack([self.latitudes, self.longitudes])), metric='haversine')
+
+    @classmethod
+    def from_df(cls, df):
+        return cls(df['business_id'].values, df['latitude'].values, df['longitude'].values)
+
+    @classmethod
+    def from_csv(cls, csv):
+        return cls.from_df(pd.read_csv(csv, usecols=['business_id', 'latitude', 'longitude']))
+
+    def positions(self, business_ids):
+        return positions(self.index, business_ids, 'spatial index')
+
+    def closest(self, start_coords, business_ids=None):
+        """
+        Closest bar to each starting point by geodesic distance (the default method of calculate_distance). The index
+        finds the nearest bar on the sphere, then the geodesic distance picks among the bars about as close.
+        :param start_coords: list of (latitude, longitude)
+        :param business_ids: bars to choose from, in the order that breaks ties (all bars if None)
+        :return: business_id of the closest bar to each starting point
+        """
+        n = len(self.business_ids)
+        # order of each bar among the allowed ones, -1 if not allowed
+        order = np.full(n, -1)
+        if business_ids is None:
+            order[:] = np.arange(n)
+        else:
+            order[self.positions(business_ids)] = np.arange(len(business_ids))
+        if (order < 0).all():
+            raise ValueError("No bar to choose from")
+
+        coords = np.asarray(start_coords, dtype=float).reshape(-1, 2)
+        points = np.radians(coords)
+        nearest = np.full(len(points), np.inf)
+        todo = np.arange(len(points))
+        k = min(n, 16)
+        while len(todo):
+            angles, found = self.tree.query(points[todo], k=k)
+            allowed = order[found] >= 0
+            has_allowed = allowed.any(axis=1)
+            first = allowed.argmax(axis=1)
+            nearest[todo[has_allowed]] = angles[has_allowed, first[has_allowed]]
+            todo = todo[~has_allowed]
+            k = min(n, 4 * k)
+
+        closest = []
+        for coord, near in zip(coords, self.tree.query_radius(points, nearest * SPHERE_MARGIN + 1e-12)):
+            near = near[order[near] >= 0]
+            near = near[np.argsort(order[near])]
+            distances = geodesic_distances(coord[0], coord[1], self.latitudes[near], self.longitudes[near])
+            closest.append(str(self.business_ids[near[np.argmin(distances)]]))
+        return closest
+
+    def nearby(self, business_ids, max_walking_time, speed=4):
+        """
+        Bars within a great-circle distance of any of the given bars. The 'manhattan' and 'euclidean' methods of
+        calculate_distance are never shorter (up to the SPHERE_MARGIN), so this is a superset of the bars within
+        max_walking_time of them, to check against the distance store.
+        :param max_walking_time: see preprocessing.business_utils.walking_time
+        :return: business_id of the bars found, in index order
+        """
+        rows = self.positions(business_ids)
+        angle = max_walking_time * speed * SPHERE_MARGIN / (EARTH_RADIUS_KM * KM_TO_MILE)
+        points = np.radians(np.column_stack([self.latitudes[rows], self.longitudes[rows]]))
+        found = self.tree.query_radius(points, angle)
+        return self.business_ids[np.unique(np.concatenate(found))]
+
+
+def load_bar_index(csv):
+    """
+    Builds the index of a preprocessed bars CSV once per version of the file (see
+    preprocessing.store_utils.load_versioned)
+    :return: BarIndex
+    """
+    return load_versioned(csv, BarIndex.from_csv)
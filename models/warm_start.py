@@ -0,0 +1,64 @@
+# Warm starts kept as plain values between queries, so they survive changes of the candidate set
+import threading
+
+
+class WarmStartStore:
+    """
+    Routes found by earlier queries, by start bar and walking time budget. Each route is stored as the nonzero
+    movement values keyed by (business_id, stop), which do not depend on the candidate list or its order.
+    """
+
+    def __init__(self, max_size=1000):
+        """
+        :param max_size: number of routes kept, the oldest ones are dropped first
+        """
+        self.max_size = max_size
+        self.routes = {}  # (start business_id, budget in minutes) -> {(business_id, stop): value}
+        # shared by the threads of crawl_model_stream
+        self.lock = threading.Lock()
+
+    def add(self, business_ids, start, routes):
+        """
+        :param business_ids: business_id of each candidate, in problem order
+        :param start: index of the start bar, or None
+        :param routes: {budget: route as a list of candidate indices}
+        """
+        start_id = None if start is None else str(business_ids[start])
+        with self.lock:
+            for budget, route in routes.items():
+                key = (start_id, budget)
+                self.routes.pop(key, None)
+                self.routes[key] = {(str(business_ids[i]), stop): 1.0 for stop, i in enumerate(route)}
+            while len(self.routes) > self.max_size:
+                del self.routes[next(iter(self.routes))]
+
+    def get(self, business_ids, start, budgets):
+        """
+        Maps the stored routes onto the current candidates. Each budget gets the route stored for the same start bar
+        and the closest budget.
+        :param business_ids: business_id of each candidate, in problem order
+        :param start: index of the start bar, or None
+        :param budgets: walking time budgets in minutes
+        :return: {budget: list of candidate indices by stop, None where the bar is no longer a candidate}
+        """
+        start_id = None if start is None else str(business_ids[start])
+        with self.lock:
+            stored = {budget: self.routes[(stored_start, budget)] for (stored_start, budget) in self.routes
+                      if stored_start == start_id}
+        if not stored:
+            return {}
+
+        index = {str(business_id): i for i, business_id in enumerate(business_ids)}
+        starts = {}
+        for budget in budgets:
+            values = stored[min(stored, key=lambda b: abs(b - budget))]
+            route = [None] * len(values)
+            for (business_id, stop), value in values.items():
+                if value > 0.5 and stop < len(route):
+                    route[stop] = index.get(business_id)
+            starts[budget] = route
+        return starts
+
+
+# Shared by the queries of this process
+WARM_STARTS = WarmStartStore()
@@ -1,42 +1,118 @@
+import itertools
+import json
+import os
+import re
+import numpy as np
 import pandas as pd
-from preprocessing.business_utils import generate_distance_matrix
+from preprocessing.business_utils import generate_distance_matrix, neighbour_graph
+from preprocessing.check_ins import aggregate_check_ins
+from preprocessing.distance_store import write_distance_graph, write_distance_store
+
+
+# Rule table of one_time_filter: a business is a bar if its categories contain one of the category_include terms,
+# and neither its categories contain a category_exclude term nor its name a name_exclude one
+BAR_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bar_rules.json')
+
+
+class BarRules:
+    """
+    The rule table compiled into one regular expression per list, so each business is checked in a single pass
+    """
+
+    def __init__(self, category_include, category_exclude, name_exclude):
+        """
+        :param category_include: terms (plain text, not patterns)
+        """
+        self.category_include = self.compile(category_include)
+        self.category_exclude = self.compile(category_exclude)
+        self.name_exclude = self.compile(name_exclude)
+
+    @staticmethod
+    def compile(terms):
+        # a pattern that never matches for an empty list
+        return re.compile('|'.join(re.escape(term) for term in terms) or '(?!)')
+
+    @classmethod
+    def from_file(cls, path=BAR_RULES_FILE):
+        with open(path) as handle:
+            rules = json.load(handle)
+        return cls(rules.get('category_include', []), rules.get('category_exclude', []),
+                   rules.get('name_exclude', []))
+
+    def matches(self, categories, name):
+        """
+        :param categories: categories string of a business, or None
+        :param name: its name, or None
+        """
+        categories = categories if isinstance(categories, str) else ''
+        name = name if isinstance(name, str) else ''
+        return self.category_include.search(categories) is not None \
+            and self.category_exclude.search(categories) is None \
+            and self.name_exclude.search(name) is None
+
+    def mask(self, df):
+        """
+        :return: boolean Series, True for the rows of df that match
+        """
+        return pd.Series([self.matches(categories, name) for categories, name in zip(df['categories'], df['name'])],
+                         index=df.index, dtype=bool)
 
 
 def read_json(file):
     return pd.read_json(file, lines=True)
 
 
+def keep_business(record, city, rules):
+    """
+    The filters of one_time_filter that only need the raw record: open, in the city and a bar by its categories and
+    name. Used to drop businesses before any DataFrame is built.
+    :param record: business, as parsed from a line of business.json
+    :param rules: BarRules
+    :return: True if one_time_filter could keep it
+    """
+    if record.get('is_open') != 1:
+        return False
+    if not isinstance(record.get('city'), str) or re.search(city, record['city']) is None:
+        return False
+    return rules.matches(str(record.get('categories')), record.get('name'))
+
+
+def read_business_json(file, city, chunksize=10000, rules=None):
+    """
+    Streams the line-delimited business.json, chunksize lines at a time, and keeps the records that pass
+    keep_business. Memory holds one chunk and the businesses kept, instead of the whole file.
+    :param rules: BarRules (default: the rule table in BAR_RULES_FILE)
+    :return: DataFrame of the businesses kept
+    """
+    if rules is None:
+        rules = BarRules.from_file()
+    records = []
+    with open(file, encoding='utf-8') as handle:
+        while True:
+            lines = list(itertools.islice(handle, chunksize))
+            if not lines:
+                break
+            chunk = [json.loads(line) for line in lines if line.strip()]
+            records.extend(record for record in chunk if keep_business(record, city, rules))
+    return pd.DataFrame.from_records(records)
+
+
 def clean_dtypes(df):
     df['categories'] = df['categories'].astype('str')
     # TODO: Add logic for other fields
     return df
 
 
-def one_time_filter(df, city):
+def one_time_filter(df, city, rules=None):
     """
     Removes all non-bars from the dataset and other locations we would never consider
     :param df:
+    :param rules: BarRules (default: the rule table in BAR_RULES_FILE)
     :return:
     """
-    df_bars = df[(df['categories'].str.contains('Bars')
-                  | df['categories'].str.contains('Pubs'))
-                 & (~df['categories'].str.contains('Sushi Bars')
-                    & ~df['categories'].str.contains('Juice Bars')
-                    & ~df['categories'].str.contains('Cinema')
-                    & ~df['categories'].str.contains('Adult Entertainment')
-                    & ~df['categories'].str.contains('Teacher')
-                    & ~df['categories'].str.contains('Steakhouses')
-                    & ~df['categories'].str.contains('Caterers')
-                    & ~df['name'].str.contains('Sex')
-                    & ~df['name'].str.contains('Pho')
-                    & ~df['name'].str.contains('Cafe')
-                    & ~df['name'].str.contains('The Jersey')
-                    & ~df['name'].str.contains('TGI')
-                    & ~df['name'].str.contains('Bar & Grill')
-                    & ~df['name'].str.contains('Coffee')
-                    & ~df['name'].str.contains('Restaurant')
-                    & ~df['name'].str.contains('Potbelly')
-                    & ~df['name'].str.contains('Oyster'))]
+    if rules is None:
+        rules = BarRules.from_file()
+    df_bars = df[rules.mask(df)]
 
     df_bars = openfilter(df_bars)
     df_bars = separate_attributes(df_bars)
@@ -104,51 +180,54 @@ def getcolumns(df):
     df_cols = df[categories]
     return df_cols
 
-def generate_business_df(business_json_file, city):
-    df = read_json(business_json_file)
+def generate_business_df(business_json_file, city, chunksize=10000, rules_file=BAR_RULES_FILE):
+    rules = BarRules.from_file(rules_file)
+    df = read_business_json(business_json_file, city, chunksize, rules)
     df = clean_dtypes(df)
-    df = one_time_filter(df, city)
+    df = one_time_filter(df, city, rules)
     return df
 
 #Take csv from other processing function
-def create_check_ins(json_file, df):
-    check_df = pd.read_json(json_file, lines=True)
-    df = pd.merge(df, check_df, how = "left", on = ["business_id"])
-
-    check_ins_2018 = []
-    for i in range(len(df)):
-        try:
-            check_ins_2018.append(df["date"][i].count("2018"))
-        except:
-            check_ins_2018.append(0)
-    df['2018_check_ins'] = check_ins_2018
+def create_check_ins(json_file, df, year=2018):
+    """
+    Adds the number of check-ins of each bar during the year (see preprocessing.check_ins)
+    """
+    check_ins = aggregate_check_ins(json_file, df['business_id'])
+    df['2018_check_ins'] = check_ins.year_totals(year)
     return df
 
-def calculate_wait_time(df, percentiles, wait_time_distr):
-    check_ins_2018 = df['2018_check_ins']
-    quantile_distr = df[df['2018_check_ins']>0]['2018_check_ins'].quantile(q = percentiles)
-    wait_time = []
+def calculate_wait_time(df, percentiles, wait_time_distr, check_ins=None):
+    """
+    Wait time of each bar from the percentile of its check-ins among the bars that have any
+    :param check_ins: check-ins of each bar, as an integer array (default: the '2018_check_ins' column of df)
+    """
+    if check_ins is None:
+        check_ins = df['2018_check_ins'].values
+    check_ins = np.asarray(check_ins)
+    quantile_distr = pd.Series(check_ins[check_ins > 0]).quantile(q=percentiles).values
     #qs = [.5, .6, .7, .8, .9, 1]
     #wait_time_distr = [0, 5, 10, 15, 20, 30]
-    for bar in range(len(df)):
-        for percentile in range(len(percentiles)):
-            if check_ins_2018[bar] <= quantile_distr[percentiles[percentile]]:
-                wait_time.append(wait_time_distr[percentile])
-                break
-
-    df['wait_time'] = wait_time
-    df = df.drop(columns = ['date', '2018_check_ins'])
+    # first percentile whose quantile the bar's check-ins do not exceed
+    df['wait_time'] = np.asarray(wait_time_distr)[np.searchsorted(quantile_distr, check_ins, side='left')]
+    df = df.drop(columns=['date', '2018_check_ins'], errors='ignore')
 
     return df
 
-def generate_full_csv(business_json_file, city, check_in_json_file, file_dest, percentiles, wait_time_distr):
-    # generate full CSV file for input to model
+def generate_full_csv(business_json_file, city, check_in_json_file, file_dest, percentiles, wait_time_distr,
+                      distance_dest='data/distances.npy', walking_radius=None):
+    # generate full CSV file for input to model, and the distance store next to it (see preprocessing.distance_store)
+    # With a walking_radius, only the pairs of bars within that walking time are kept, in a sparse graph written to
+    # distance_dest with a .npz extension, for cities whose full matrix does not fit in memory
     df = generate_business_df(business_json_file, city)
-    df = create_check_ins(check_in_json_file, df)
-    df = calculate_wait_time(df, percentiles, wait_time_distr)
+    check_ins = aggregate_check_ins(check_in_json_file, df['business_id'])
+    df = calculate_wait_time(df, percentiles, wait_time_distr, check_ins.year_totals(2018))
     df.to_csv(file_dest)
 
-    # Generate distance matrix as a CSV
+    # Generate distance matrix as a binary store
     coordinates = list(zip(df.latitude, df.longitude))
-    distance_matrix = generate_distance_matrix(coordinates, df['business_id'], 'manhattan')
-    distance_matrix.to_csv('data/distances.csv')
\ No newline at end of file
+    if walking_radius is not None:
+        graph = neighbour_graph(coordinates, walking_radius, 'manhattan')
+        write_distance_graph(os.path.splitext(distance_dest)[0] + '.npz', graph, df['business_id'], walking_radius)
+    else:
+        distance_matrix = generate_distance_matrix(coordinates, df['business_id'], 'manhattan')
+        write_distance_store(distance_dest, distance_matrix.values, df['business_id'])
\ No newline at end of file
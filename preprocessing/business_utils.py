@@ -2,6 +2,16 @@ import numpy as np
 import math
 from geopy import distance
 import pandas as pd
+import scipy.sparse as sp
+from scipy.spatial import cKDTree
+
+# radius of the 'manhattan' method, and mean radius of the Earth for the search of the 'euclidean' one
+EARTH_RADIUS_KM = 6371
+KM_TO_MILE = 0.621371
+# WGS-84, the ellipsoid geopy measures distances on
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+METERS_PER_MILE = 1609.344
 
 def calculate_distance(loc1, loc2, method='euclidean'):
     """
@@ -38,6 +48,132 @@ def calculate_distance(loc1, loc2, method='euclidean'):
         return distance.distance(loc1, loc2).miles
 
 
+def manhattan_distances(lat1, lon1, lat2, lon2):
+    """
+    Vectorized 'manhattan' method of calculate_distance
+    :param lat1: array of latitudes, in degrees (lon1, lat2 and lon2 alike, broadcast together)
+    :return: Distances in miles (array)
+    """
+    distances = 0
+    for delta in [np.radians(np.abs(lat1 - lat2)), np.radians(np.abs(lon1 - lon2))]:
+        a = np.sin(delta / 2) ** 2
+        distances = distances + EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return distances * KM_TO_MILE
+
+
+def geodesic_distances(lat1, lon1, lat2, lon2, tolerance=1e-12, max_iterations=200):
+    """
+    Vectorized 'euclidean' method of calculate_distance: Vincenty's inverse formula on the WGS-84 ellipsoid, which
+    agrees with geopy's geodesic to well under a millimetre. The few pairs it does not converge for (nearly antipodal
+    points) are handed to geopy.
+    :param lat1: array of latitudes, in degrees (lon1, lat2 and lon2 alike, broadcast together)
+    :return: Distances in miles (array)
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [lat1, lon1, lat2, lon2]])
+    b = (1 - WGS84_F) * WGS84_A
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sin_U1, cos_U1, sin_U2, cos_U2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for iteration in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_U2 * sin_lam, cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lam)
+            cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # coincident points have a zero distance, whatever the other terms
+            sin_alpha = np.where(sin_sigma == 0, 0, cos_U1 * cos_U2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # points on the equator
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0, cos_sigma - 2 * sin_U1 * sin_U2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam - previous) <= tolerance
+            if converged.all():
+                break
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - b ** 2) / b ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    distances = b * A * (sigma - delta_sigma) / METERS_PER_MILE
+
+    for index in zip(*np.nonzero(~converged)):
+        distances[index] = distance.distance((lat1[index], lon1[index]), (lat2[index], lon2[index])).miles
+    return distances
+
+
+def distance_array(locations, method='euclidean', block_size=1000000):
+    """
+    Distances between every pair of locations, computed in blocks of rows of about block_size pairs. Each block only
+    covers the columns from its first row on and is mirrored, as the matrix is symmetric.
+    :param locations: list of n tuples representing location coordinates
+    :param method: 'euclidean', 'manhattan' (see calculate_distance)
+    :return: nxn array of distances in miles
+    """
+    distances_between = manhattan_distances if method == 'manhattan' else geodesic_distances
+    coordinates = np.asarray(locations, dtype=float).reshape(-1, 2)
+    latitudes, longitudes = coordinates[:, 0], coordinates[:, 1]
+    n = len(coordinates)
+    matrix = np.zeros((n, n))
+    rows = max(1, block_size // max(n, 1))
+    for start in range(0, n, rows):
+        end = min(n, start + rows)
+        block = distances_between(latitudes[start:end, None], longitudes[start:end, None], latitudes[None, start:],
+                                  longitudes[None, start:])
+        matrix[start:end, start:] = block
+        matrix[start:, start:end] = block.T
+    return matrix
+
+
+def neighbour_graph(locations, max_walking_time, method='euclidean', speed=4):
+    """
+    Walking times of the pairs of locations at most max_walking_time apart, as a sparse matrix. A KD-tree finds the
+    pairs that may be within reach, so the build grows with the number of such pairs rather than with n^2: the
+    'manhattan' distance is the L1 distance of the latitudes and longitudes scaled to miles, and the 'euclidean' one is
+    bounded with the chord between the points on a sphere. The distances of those pairs are then computed exactly.
+    :param locations: list of n tuples representing location coordinates
+    :param max_walking_time: walking radius, in the unit of walking_time
+    :param method: 'euclidean', 'manhattan' (see calculate_distance)
+    :param speed: see walking_time
+    :return: nxn CSR matrix of walking times. The pairs within the radius are all stored, the diagonal and
+    distances of 0 included, and a missing entry means out of reach.
+    """
+    coordinates = np.radians(np.asarray(locations, dtype=float).reshape(-1, 2))
+    n = len(coordinates)
+    radius = max_walking_time * speed
+    if method == 'manhattan':
+        tree = cKDTree(coordinates * EARTH_RADIUS_KM * KM_TO_MILE)
+        pairs = tree.query_pairs(radius * (1 + 1e-9), p=1, output_type='ndarray')
+        distances_between = manhattan_distances
+    else:
+        latitudes, longitudes = coordinates[:, 0], coordinates[:, 1]
+        points = np.column_stack([np.cos(latitudes) * np.cos(longitudes), np.cos(latitudes) * np.sin(longitudes),
+                                  np.sin(latitudes)])
+        # the ellipsoid is within half a percent of the sphere
+        angle = min(np.pi, radius * 1.01 / (EARTH_RADIUS_KM * KM_TO_MILE))
+        tree = cKDTree(points)
+        pairs = tree.query_pairs(2 * np.sin(angle / 2), output_type='ndarray')
+        distances_between = geodesic_distances
+
+    pairs = pairs.reshape(-1, 2)
+    degrees = np.degrees(coordinates)
+    i, j = pairs[:, 0], pairs[:, 1]
+    times = walking_time(distances_between(degrees[i, 0], degrees[i, 1], degrees[j, 0], degrees[j, 1]), speed)
+    close = times <= max_walking_time
+    i, j, times = i[close], j[close], times[close]
+    rows = np.concatenate([i, j, np.arange(n)])
+    cols = np.concatenate([j, i, np.arange(n)])
+    return sp.csr_matrix((np.concatenate([times, times, np.zeros(n)]), (rows, cols)), shape=(n, n))
+
+
 def walking_time(dist, speed=4):
     """
     Calcu lates the time required to walk the distance for a given speed.
@@ -57,11 +193,7 @@ def generate_distance_matrix(locations, names, method='euclidean'):
     :param names: list of names, ordered in the same way as locations
     :return: data frame, nxn matrix containing all of the distances
     """
-    n = len(locations)
-    dist_matrix = [[0] * n for i in range(n)]
-    for row in range(n):
-        for col in range(n):
-            dist_matrix[row][col] = walking_time(calculate_distance(locations[row], locations[col], method))
+    dist_matrix = walking_time(distance_array(locations, method))
 
     return pd.DataFrame(dist_matrix, columns=names, index=names)
 
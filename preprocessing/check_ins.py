@@ -0,0 +1,65 @@
+# Check-in counts of the bars, aggregated while streaming checkin.json
+import json
+import numpy as np
+
+
+class CheckInCounts:
+    """
+    Number of check-ins of each business by year, weekday (Monday is 0) and hour
+    """
+
+    def __init__(self, business_ids, years, counts):
+        """
+        :param business_ids: business_id of each row
+        :param years: year of each entry of the second axis
+        :param counts: integer array of shape (businesses, years, 7, 24)
+        """
+        self.business_ids = np.asarray(business_ids, dtype=str)
+        self.years = list(years)
+        self.counts = counts
+
+    def year_totals(self, year):
+        """
+        :return: Check-ins of each business during the year (integer array, 0 for the years without any)
+        """
+        if year not in self.years:
+            return np.zeros(len(self.business_ids), dtype=self.counts.dtype)
+        return self.counts[:, self.years.index(year)].sum(axis=(1, 2))
+
+
+def aggregate_check_ins(json_file, business_ids):
+    """
+    Streams checkin.json line by line. Only the lines of the given businesses have their timestamps parsed, and those
+    are added to per-business counts, so the file is never held in memory.
+    :param json_file: line-delimited JSON, one line per business with a comma-separated 'date' string of timestamps
+    :param business_ids: businesses to count, in the order of the rows of the result
+    :return: CheckInCounts
+    """
+    business_ids = np.asarray(business_ids, dtype=str)
+    rows = {business_id: i for i, business_id in enumerate(business_ids)}
+    by_year = {}  # year -> array (businesses, 7, 24)
+    with open(json_file, encoding='utf-8') as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            row = rows.get(str(record.get('business_id')))
+            if row is None or not record.get('date'):
+                continue
+
+            stamps = np.array(record['date'].split(', '), dtype='datetime64[s]')
+            years = stamps.astype('datetime64[Y]').astype(int) + 1970
+            # 1970-01-01 was a Thursday
+            weekdays = (stamps.astype('datetime64[D]').astype(int) + 3) % 7
+            hours = stamps.astype(int) // 3600 % 24
+            for year in np.unique(years):
+                if year not in by_year:
+                    by_year[year] = np.zeros((len(business_ids), 7, 24), dtype=np.int32)
+                in_year = years == year
+                by_year[year][row] += np.bincount(weekdays[in_year] * 24 + hours[in_year],
+                                                  minlength=7 * 24).reshape(7, 24).astype(np.int32)
+
+    years = sorted(by_year)
+    counts = np.stack([by_year[year] for year in years], axis=1) if years \
+        else np.zeros((len(business_ids), 0, 7, 24), dtype=np.int32)
+    return CheckInCounts(business_ids, [int(year) for year in years], counts)
@@ -0,0 +1,145 @@
+# Binary distance matrix: a float32 .npy that is memory-mapped on load, or the sparse graph of the pairs within a
+# walking radius as a .npz, plus the business_id of each row
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from preprocessing.store_utils import load_versioned, positions
+
+
+def ids_path(path):
+    """
+    :param path: distance store .npy or .npz
+    :return: Path of the business_id index stored next to it
+    """
+    return os.path.splitext(path)[0] + '_ids.npy'
+
+
+def write_distance_store(path, matrix, business_ids):
+    """
+    :param path: destination .npy
+    :param matrix: nxn walking time matrix
+    :param business_ids: business_id of each row (and column)
+    """
+    np.save(path, np.asarray(matrix, dtype=np.float32))
+    np.save(ids_path(path), np.asarray(business_ids, dtype=str))
+
+
+def write_distance_graph(path, graph, business_ids, radius):
+    """
+    :param path: destination .npz
+    :param graph: CSR walking time matrix of the pairs within radius (see preprocessing.business_utils.neighbour_graph)
+    :param business_ids: business_id of each row (and column)
+    :param radius: walking time the graph was built for
+    """
+    graph = sp.csr_matrix(graph)
+    np.savez(path, data=graph.data.astype(np.float32), indices=graph.indices, indptr=graph.indptr,
+             shape=np.array(graph.shape), radius=np.array(radius))
+    np.save(ids_path(path), np.asarray(business_ids, dtype=str))
+
+
+class DistanceStore:
+    """
+    Walking time matrix of the whole dataset. Only the rows asked for are read from disk.
+    """
+
+    def __init__(self, matrix, business_ids):
+        """
+        :param matrix: nxn array or memory map
+        :param business_ids: business_id of each row
+        """
+        self.matrix = matrix
+        self.business_ids = np.asarray(business_ids, dtype=str)
+        # business_id -> row
+        self.index = pd.Index(self.business_ids)
+
+    @classmethod
+    def open(cls, path):
+        """
+        :param path: .npy written by write_distance_store, or a distance CSV as written by earlier versions (parsed in
+        full)
+        """
+        if path.endswith('.csv'):
+            dima_df = pd.read_csv(path, header=0)
+            return cls(dima_df.drop(columns='business_id').values.astype(np.float32), dima_df['business_id'].values)
+        return cls(np.load(path, mmap_mode='r'), np.load(ids_path(path)))
+
+    def positions(self, business_ids):
+        """
+        :return: Row of each business_id (array)
+        """
+        return positions(self.index, business_ids, 'distance store')
+
+    def submatrix(self, business_ids):
+        """
+        :return: Walking times between the given bars, in their order (contiguous float array). Only those entries are
+        read, so the cost grows with the square of the number of bars rather than with the size of the store.
+        """
+        rows = self.positions(business_ids)
+        return np.ascontiguousarray(self.matrix[np.ix_(rows, rows)], dtype=float)
+
+    def within(self, business_ids, limit, among=None):
+        """
+        :param business_ids: bars to measure from
+        :param limit: walking time
+        :param among: business_id of the bars to check, e.g. from a spatial index (see models.spatial). All if None.
+        :return: business_id of the bars within limit of any of the given bars
+        """
+        rows = self.positions(business_ids)
+        if among is not None:
+            close = (self.matrix[np.ix_(rows, self.positions(among))] <= limit).any(axis=0)
+            return np.asarray(among, dtype=str)[close]
+        # the matrix is symmetric, so rows are read rather than scattered columns
+        close = (np.asarray(self.matrix[rows]) <= limit).any(axis=0)
+        return self.business_ids[close]
+
+
+class SparseDistanceStore(DistanceStore):
+    """
+    DistanceStore over a neighbour graph: the pairs that are not stored are further apart than the radius, and get an
+    infinite walking time, which the route solvers never select (see models.problem.get_arcs)
+    """
+
+    def __init__(self, matrix, business_ids, radius):
+        """
+        :param matrix: nxn CSR walking time matrix, the pairs within radius all stored
+        :param radius: walking time the graph was built for
+        """
+        super().__init__(matrix, business_ids)
+        self.radius = radius
+
+    @classmethod
+    def open(cls, path):
+        with np.load(path) as arrays:
+            matrix = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                   shape=tuple(arrays['shape']))
+            radius = float(arrays['radius'])
+        return cls(matrix, np.load(ids_path(path)), radius)
+
+    def submatrix(self, business_ids):
+        rows = self.positions(business_ids)
+        block = self.matrix[rows][:, rows].tocoo()
+        dense = np.full(block.shape, np.inf)
+        dense[block.row, block.col] = block.data
+        return dense
+
+    def within(self, business_ids, limit, among=None):
+        if limit > self.radius:
+            print("Walking time {} is beyond the radius of the distance graph ({}), bars further than {} are left "
+                  "out".format(limit, self.radius, self.radius))
+        block = self.matrix[self.positions(business_ids)]
+        candidates = self.business_ids
+        if among is not None:
+            block = block[:, self.positions(among)]
+            candidates = np.asarray(among, dtype=str)
+        return candidates[np.unique(block.indices[block.data <= limit])]
+
+
+def load_distance_store(path):
+    """
+    Opens a distance store once per version of the file (see preprocessing.store_utils.load_versioned)
+    :param path: a neighbour graph .npz (see SparseDistanceStore), or see DistanceStore.open
+    :return: DistanceStore
+    """
+    store_class = SparseDistanceStore if path.endswith('.npz') else DistanceStore
+    return load_versioned(path, store_class.open)
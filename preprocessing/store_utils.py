@@ -0,0 +1,36 @@
+# Helpers shared by the data artifacts that are loaded once and queried by business_id (see
+# preprocessing.distance_store and models.spatial)
+import os
+import numpy as np
+
+# (loader, path) -> (file version, loaded object)
+_loaded = {}
+
+
+def positions(index, business_ids, what):
+    """
+    :param index: pd.Index of the business_id of each row
+    :param business_ids: business_id of the rows wanted
+    :param what: name of the artifact, for the error message
+    :return: Row of each business_id (array)
+    """
+    rows = index.get_indexer(np.asarray(business_ids, dtype=str))
+    if (rows < 0).any():
+        missing = [str(business_id) for business_id in np.asarray(business_ids)[rows < 0][:5]]
+        raise KeyError("Bars missing from the {}: {}".format(what, missing))
+    return rows
+
+
+def load_versioned(path, loader):
+    """
+    Loads a file once per version of it and reuses the result across requests
+    :param loader: called as loader(path) when the file is new or has been rewritten
+    :return: What loader returned for the current version of the file
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _loaded.get((loader, path))
+    if cached is None or cached[0] != version:
+        cached = (version, loader(path))
+        _loaded[(loader, path)] = cached
+    return cached[1]
@@ -26,7 +26,7 @@ total_max_walking_time = 1
 max_walking_each = 0.35
 max_total_wait = 1.0
 csv = "data/processed_data.csv"
-distance_csv = "data/distances.csv"
+distance_csv = "data/distances.npy"
 start_coord = (43.6426, -79.3871)
 solutions = crawl_model(min_review_ct, min_rating, date, budget_range, start_time, end_time, bar_num,
                                  total_max_walking_time, max_walking_each, max_total_wait, csv, distance_csv,